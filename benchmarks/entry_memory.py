@@ -0,0 +1,138 @@
+"""
+    Measures the memory taken per queued entry at 100k entries, spread over two servers that queue the same 50k
+    songs, for the current compact entries and for the layout entries had before (`LegacyEntry`).
+
+    Run from the repository root: python -m benchmarks.entry_memory [--entries 100000]
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+
+from musicbot.entry import URLPlaylistEntry
+from musicbot.lib.indexed_queue import IndexedQueue
+
+
+class LegacyEntry:
+    """
+        The attributes a `URLPlaylistEntry` had before `__slots__`, interned tracks and lazily resolved ids.
+    """
+
+    def __init__(self, playlist, url, title, duration=0, expected_filename=None, extractor=None, id=None, **meta):
+        self.filename = None
+        self._is_downloading = False
+        self.fair_tag = 0
+        self._waiting_futures = []
+
+        self.playlist = playlist
+        self.url = url
+        self.title = title
+        self.duration = duration
+        self.expected_filename = expected_filename
+        self.extractor = extractor
+        self.id = id
+        self.meta = meta
+        self.needs_validation = False
+        self._json = None
+        self.stream_url = None
+        self.stream_headers = {}
+        self.download_folder = self.playlist.downloader.download_folder
+
+    def to_json(self):
+        if self._json is None:
+            self._json = (0, json.dumps({
+                "version": 2,
+                "url": self.url,
+                "title": self.title,
+                "duration": self.duration,
+                "extractor": self.extractor,
+                "id": self.id,
+                "expected_filename": self.expected_filename,
+                "meta": {"author": self.meta["author"].id, "channel": self.meta["channel"].id, "seek": 0}
+            }))
+
+        return self._json[1]
+
+
+class Namespace:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class FakeServer:
+    def __init__(self, members):
+        self.members = {member.id: member for member in members}
+
+    def get_member(self, id):
+        return self.members.get(id, None)
+
+
+def fake_servers(count=2, users=20):
+    channels = {}
+    for i in range(count):
+        server = FakeServer([Namespace(id='user%d' % user, name='User %d' % user) for user in range(users)])
+        channels['channel%d' % i] = Namespace(id='channel%d' % i, server=server)
+
+    bot = Namespace(get_channel=channels.get)
+    playlists = [
+        Namespace(bot=bot, serverid=str(i), downloader=Namespace(download_folder='audio_cache'), entries=IndexedQueue())
+        for i in range(count)
+    ]
+    return playlists, [channels['channel%d' % i] for i in range(count)]
+
+
+def make_entries(cls, count):
+    playlists, channels = fake_servers()
+    entries = []
+
+    for i in range(count):
+        server, song = i % 2, (i // 2) % (count // 2)
+
+        # Fresh strings for every entry, like the ones in a youtube-dl info dict.
+        video_id = '%011d' % song
+        title = 'Artist %d - Song title number %d (Official Video)' % (song % 997, song)
+        channel = channels[server]
+
+        entries.append(cls(
+            playlists[server],
+            'https://www.youtube.com/watch?v=' + video_id,
+            title,
+            200 + song % 300,
+            'audio_cache/youtube-%s-%s.m4a' % (video_id, title.replace(' ', '_')),
+            'youtube',
+            video_id,
+            channel=channel,
+            author=channel.server.get_member('user%d' % (i % 20))
+        ))
+
+    return entries
+
+
+def measure(cls, count):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        entries = make_entries(cls, count)
+        queued = tracemalloc.get_traced_memory()[0]
+
+        for entry in entries:
+            entry.to_json()
+        saved = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    return queued / count, saved / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--entries', type=int, default=100000, help="how many entries to queue (default: 100000)")
+    args = parser.parse_args()
+
+    for name, cls in (("before", LegacyEntry), ("after", URLPlaylistEntry)):
+        queued, saved = measure(cls, args.entries)
+        print("%-6s %5d bytes per entry, %5d with its saved json" % (name, queued, saved))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+    Compares the queue operations of `IndexedQueue` with the `deque` (plus linear scans) playlists used before, at
+    10k and 100k queued entries.
+
+    Run from the repository root: python -m benchmarks.indexed_queue [--sizes 10000 100000]
+"""
+import argparse
+import random
+import time
+from collections import deque
+from itertools import islice
+
+from musicbot.lib.indexed_queue import IndexedQueue
+
+# Operations timed per measurement.
+OPS = 200
+
+
+class FakeEntry:
+    __slots__ = ('duration', 'author_id')
+
+    def __init__(self, i):
+        self.duration = random.randint(60, 600)
+        self.author_id = 'user%d' % (i % 50)
+
+
+def per_op(f):
+    start = time.perf_counter()
+    f()
+    return (time.perf_counter() - start) / OPS * 1e6
+
+
+def bench(size):
+    entries = [FakeEntry(i) for i in range(size)]
+    old, new = deque(entries), IndexedQueue(entries)
+
+    picks = random.sample(entries, OPS)
+    positions = [random.randrange(size - OPS) for _ in range(OPS)]
+
+    results = [
+        ("remove", per_op(lambda: [old.remove(e) for e in picks]), per_op(lambda: [new.remove(e) for e in picks])),
+        ("insert", per_op(lambda: [old.insert(p, e) for p, e in zip(positions, picks)]),
+            per_op(lambda: [new.insert(p, e) for p, e in zip(positions, picks)])),
+        ("time until", per_op(lambda: [sum(e.duration for e in islice(old, p)) for p in positions]),
+            per_op(lambda: [new.duration_until(p) for p in positions])),
+        ("index", per_op(lambda: [old.index(e) for e in picks]), per_op(lambda: [new.index(e) for e in picks])),
+        ("count for user", per_op(lambda: [sum(1 for e in old if e.author_id == 'user1') for _ in range(OPS)]),
+            per_op(lambda: [new.count_for('user1') for _ in range(OPS)]))
+    ]
+
+    print("%s entries" % size)
+    for name, before, after in results:
+        print("  %-15s deque %10.1f us/op   indexed %6.1f us/op" % (name, before, after))
+
+    # The max song length filter of a playlist import, dropping every 10th song.
+    dropped = entries[::10]
+    old, new = deque(entries), IndexedQueue(entries)
+
+    start = time.perf_counter()
+    for entry in dropped:
+        old.remove(entry)
+    before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for entry in dropped:
+        new.remove(entry)
+    after = time.perf_counter() - start
+
+    print("  filtering %s songs: deque %.2fs   indexed %.3fs" % (len(dropped), before, after))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help="queue sizes to time")
+    args = parser.parse_args()
+
+    random.seed(1)
+    for size in args.sizes:
+        bench(size)
+
+
+if __name__ == "__main__":
+    main()
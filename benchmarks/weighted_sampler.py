@@ -0,0 +1,67 @@
+"""
+    Compares picking a surprise song with `weighted_choice` over the whole play count hash, as `!surprise` used to,
+    with `WeightedSampler` at 1M distinct urls.
+
+    Run from the repository root: python -m benchmarks.weighted_sampler [--urls 1000000]
+"""
+import argparse
+import random
+import time
+
+from musicbot.lib.weighted_sampler import WeightedSampler
+from musicbot.utils import weighted_choice
+
+# The `diminish` `!surprise` uses.
+DIMINISH = 100
+
+# Picks and updates timed per measurement.
+OPS = 10000
+
+
+def fake_played(count):
+    # Counts as redis returns them, as strings, mostly songs played a couple of times.
+    return {
+        'https://www.youtube.com/watch?v=%011d' % i: str(random.choice([1, 1, 1, 2, 3, 5, 8, 40, 150, 900]))
+        for i in range(count)
+    }
+
+
+def timed(f, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        f()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--urls', type=int, default=1000000, help="how many distinct urls were played (default: 1M)")
+    args = parser.parse_args()
+
+    random.seed(1)
+    played = fake_played(args.urls)
+
+    before = timed(lambda: weighted_choice(played, DIMINISH), repeat=3)
+
+    sampler = WeightedSampler(diminish=DIMINISH)
+    sampler.start_loading()
+    load = timed(lambda: sampler.finish_loading(WeightedSampler.build(played, DIMINISH)))
+
+    pick = timed(sampler.choice, repeat=OPS)
+
+    known = iter(random.sample(list(played), OPS))
+    update = timed(lambda: sampler.add(next(known)), repeat=OPS)
+
+    new = iter(range(OPS))
+    append = timed(lambda: sampler.add('https://example.com/%d' % next(new)), repeat=OPS)
+
+    print("%s urls" % args.urls)
+    print("  weighted_choice per pick  %10.1f ms (plus transferring the hash)" % (before * 1e3))
+    print("  sampler, loading once     %10.1f ms" % (load * 1e3))
+    print("  sampler per pick          %10.1f us" % (pick * 1e6))
+    print("  sampler per play          %10.1f us" % (update * 1e6))
+    print("  sampler per new url       %10.1f us" % (append * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+    Compares building a YoutubeDL object per call, as every extraction and file name used to, with the per-thread
+    pool and `Downloader.prepare_filename` on the items of a playlist import.
+
+    Run from the repository root: python -m benchmarks.ytdl_pool [--entries 500]
+"""
+import argparse
+import time
+
+from musicbot.downloader import Downloader
+
+
+def fake_playlist(count):
+    infos = [{
+        "extractor": "youtube",
+        "id": "9R8a-SKw_%d" % i,
+        "title": "NOMA – Brain Power: «%d» / ü 日本 & co?" % i,
+        "ext": "m4a",
+        "duration": 200
+    } for i in range(count)]
+
+    # Names that need the odd corners of the output template.
+    infos.append({"extractor": "generic", "id": "a b", "title": None, "ext": "mp3"})
+    infos.append({"extractor": "soundcloud:set", "id": "123", "title": "x", "ext": "mp3"})
+    return infos
+
+
+def timed(f, infos):
+    start = time.perf_counter()
+    for info in infos:
+        f(info)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--entries', type=int, default=500, help="the size of the imported playlist (default: 500)")
+    args = parser.parse_args()
+
+    downloader = Downloader('audio_cache')
+    pool = downloader.ytdl_pool
+    infos = fake_playlist(args.entries)
+
+    try:
+        reference = pool.build(safe=True)
+        mismatches = [info for info in infos if reference.prepare_filename(info) != downloader.prepare_filename(info)]
+        print("prepare_filename matches YoutubeDL for %s of %s items" % (len(infos) - len(mismatches), len(infos)))
+
+        results = [
+            ("YoutubeDL per file name", timed(lambda info: pool.build(safe=True).prepare_filename(info), infos)),
+            ("prepare_filename", timed(downloader.prepare_filename, infos)),
+            ("YoutubeDL per extraction", timed(lambda info: pool.build(safe=False), infos)),
+            ("pooled YoutubeDL", timed(lambda info: downloader.get_ytdl(safe=False), infos))
+        ]
+
+        for name, seconds in results:
+            print("%-26s %8.3fs  %8.3f ms per item" % (name, seconds, seconds * 1000 / len(infos)))
+    finally:
+        downloader.storage.close()
+
+
+if __name__ == "__main__":
+    main()
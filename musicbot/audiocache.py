@@ -0,0 +1,522 @@
+import argparse
+import bisect
+import errno
+import hashlib
+import logging
+import math
+import os
+import time
+from collections import defaultdict
+
+import asyncio
+from musicbot.utils import file_digest
+
+log = logging.getLogger(__name__)
+
+# Leftovers of downloads that didn't finish.
+partial_suffixes = ('.part', '.ytdl', '.temp')
+
+# When evicting, every doubling of a song's play count counts as much as having been used this much more recently.
+PLAY_WEIGHT = 60 * 60 * 24
+
+# Eviction frees up space until usage is under this fraction of the quota, so it doesn't run after every download.
+EVICT_TO = 0.9
+
+
+# Where the blob store keeps its files, inside the audio cache folder.
+BLOB_FOLDER = '.blobs'
+
+# The url a file was downloaded from is kept next to it in `.<name>.url`, for play counts after a restart.
+URL_SUFFIX = '.url'
+
+
+class _CachedFile:
+    __slots__ = ('size', 'accessed', 'url', 'inode', 'warmed')
+
+    def __init__(self, size, accessed, url=None, inode=None):
+        self.size = size
+        self.accessed = accessed
+        self.url = url
+        self.inode = inode
+
+        # Downloaded by the cache warmer rather than for a queued song.
+        self.warmed = False
+
+
+def sha256sum(filename, chunk_size=4 * 1024 * 1024):
+    return file_digest(filename, hashlib.sha256, chunk_size)
+
+
+class BlobStore:
+    """
+        Stores every distinct piece of audio once, as `<folder>/<sha256[:2]>/<sha256>`.  The names the downloader
+        gives files are hardlinks to these blobs, so the same song downloaded under a different title, extension or
+        hash suffix doesn't take up space twice.
+
+        A blob is only kept while some name still links to it, see `collect`.  On filesystems without hardlinks
+        files are left alone and nothing is deduplicated.
+
+        Everything in here blocks, so call it from an executor.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.supported = True
+
+    def blob_path(self, digest):
+        return os.path.join(self.folder, digest[:2], digest)
+
+    def intern(self, path, digest=None):
+        """
+            Replaces `path` with a link to the blob holding its content, creating the blob if there isn't one yet.
+            Returns the blob's path (None if deduplication isn't possible) and how many bytes were reclaimed.
+        """
+        if not self.supported:
+            return None, 0
+
+        digest = digest or sha256sum(path)
+        blob = self.blob_path(digest)
+
+        try:
+            if not os.path.exists(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.link(path, blob)
+                return blob, 0
+
+            if os.path.samefile(blob, path):
+                return blob, 0
+
+            size = os.path.getsize(path)
+            temp = path + '.temp'
+            os.link(blob, temp)
+            os.replace(temp, path)
+            return blob, size
+
+        except OSError as e:
+            if e.errno in (errno.EPERM, errno.EXDEV, errno.EMLINK, errno.ENOTSUP, errno.ENOSYS):
+                log.warning("Hardlinks don't work in %s (%s), the audio cache won't be deduplicated", self.folder, e)
+                self.supported = False
+                return None, 0
+
+            raise
+
+    def list(self):
+        """
+            Returns {inode: path} for every blob, deleting the ones no name links to anymore.
+        """
+        blobs = {}
+
+        try:
+            prefixes = [e.path for e in os.scandir(self.folder) if e.is_dir()]
+        except FileNotFoundError:
+            return blobs
+
+        for prefix in prefixes:
+            with os.scandir(prefix) as it:
+                for e in it:
+                    if not e.is_file() or e.name.endswith(partial_suffixes):
+                        continue
+
+                    stat = e.stat()
+                    if stat.st_nlink > 1:
+                        blobs[stat.st_ino] = e.path
+                    else:
+                        log.info("Removing unused blob %s", e.name)
+                        os.remove(e.path)
+
+        return blobs
+
+    def migrate(self, folder):
+        """
+            Deduplicates every file in `folder`.  Returns how many files were replaced and the bytes reclaimed.
+        """
+        files = reclaimed = 0
+
+        with os.scandir(folder) as it:
+            names = [e.path for e in it if not e.name.startswith('.') and e.is_file()]
+
+        for path in names:
+            if path.endswith(partial_suffixes):
+                continue
+
+            blob, size = self.intern(path)
+            if blob is None:
+                break
+
+            if size:
+                files += 1
+                reclaimed += size
+
+        return files, reclaimed
+
+
+class AudioCacheIndex:
+    """
+        An in-memory index of the audio cache folder, so that checking whether a song has been downloaded before
+        doesn't mean listing the whole folder.
+
+        Files can be found by their full name, by their name without the extension and by their name up to the last
+        dash (generic downloads get a piece of their hash appended there).  Names are also kept sorted, which allows
+        looking files up by the `extractor-id-` start of their name regardless of title.
+
+        The index is built in the background by `scan` and kept up to date with `add` and `remove`.  Every lookup
+        checks that the file is still there and forgets about it if it isn't.
+
+        The url a file was downloaded from is saved next to it by `store` and read back by `scan`.
+
+        When a `quota` (in bytes) is set, `enforce_quota` deletes the files with the lowest score until the folder
+        fits again.  The score is the last time the file was used plus `PLAY_WEIGHT` for every doubling of its play
+        count.  Files matched by `pinned()` (songs that are queued or playing) are never deleted.
+
+        Finished downloads go through `store`, which moves their content into the `BlobStore`.  Names linking to the
+        same content are only counted once towards the usage, and the blob goes once the last of them is evicted.
+    """
+
+    def __init__(self, folder, quota=0, pinned=None, play_counts=None):
+        self.folder = folder
+        self.quota = quota
+
+        # Returns the names, names without extension and generic names (see above) of the files in use.
+        self.pinned = pinned or set
+
+        # Coroutine function returning the play counts for a list of urls.
+        self.play_counts = play_counts
+
+        self.blobs = BlobStore(os.path.join(folder, BLOB_FOLDER))
+
+        self.usage = 0
+        self.hits = 0
+        self.warm_hits = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.deduplicated_bytes = 0
+
+        self._files = {}
+        self._inodes = defaultdict(int)
+        self._blob_paths = {}
+        self._sorted = []
+        self._stems = defaultdict(set)
+        self._generic = defaultdict(set)
+
+        self._ready = asyncio.Event()
+        self._evicting = False
+
+    def __len__(self):
+        return len(self._files)
+
+    @property
+    def is_ready(self):
+        return self._ready.is_set()
+
+    async def wait_ready(self):
+        await self._ready.wait()
+
+    def scan(self, loop, executor=None):
+        """
+            Builds the index in `executor`.  Files added while the scan runs are kept.
+        """
+        future = loop.run_in_executor(executor, self._list_folder)
+        future.add_done_callback(self._scan_done)
+        return future
+
+    def _url_path(self, name):
+        return os.path.join(self.folder, '.' + name + URL_SUFFIX)
+
+    def _list_folder(self):
+        files = []
+        urls = set()
+
+        try:
+            with os.scandir(self.folder) as it:
+                for e in it:
+                    if e.name.startswith('.'):
+                        if e.name.endswith(URL_SUFFIX):
+                            urls.add(e.name[1:-len(URL_SUFFIX)])
+                    elif e.is_file():
+                        stat = e.stat()
+                        files.append([e.name, stat.st_size, max(stat.st_atime, stat.st_mtime), None, stat.st_ino])
+        except FileNotFoundError:
+            pass
+
+        for item in files:
+            if item[0] in urls:
+                urls.discard(item[0])
+                item[3] = self._read_url(item[0])
+
+        # Whatever is left belongs to files that are gone.
+        for name in urls:
+            try:
+                os.remove(self._url_path(name))
+            except OSError:
+                pass
+
+        return files, self.blobs.list()
+
+    def _read_url(self, name):
+        try:
+            with open(self._url_path(name), encoding='utf8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _save_url(self, name, url):
+        try:
+            with open(self._url_path(name), 'w', encoding='utf8') as f:
+                f.write(url)
+        except OSError:
+            log.exception("Could not save the url of %s", name)
+
+    def _scan_done(self, future):
+        try:
+            files, blobs = future.result()
+        except Exception:
+            log.exception("Could not index %s", self.folder)
+            files, blobs = [], {}
+
+        self._blob_paths.update(blobs)
+
+        for name, size, accessed, url, inode in files:
+            self.add(name, size=size, accessed=accessed, url=url, inode=inode)
+
+        log.info("Indexed %s files (%s MB) in %s", len(self._files), self.usage // 1024 ** 2, self.folder)
+        self._ready.set()
+
+    def add(self, filename, size=None, accessed=None, url=None, inode=None):
+        name = os.path.basename(filename)
+
+        if name in self._files or name.endswith(partial_suffixes):
+            return
+
+        if size is None:
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                return
+
+            size, inode = stat.st_size, stat.st_ino
+
+        self._files[name] = _CachedFile(size, accessed or time.time(), url, inode)
+        self._inodes[inode] += 1
+
+        # Hardlinks to the same blob only take up space once.
+        if self._inodes[inode] == 1:
+            self.usage += size
+
+        bisect.insort(self._sorted, name)
+        self._stems[name.rsplit('.', 1)[0]].add(name)
+        self._generic[name.rsplit('-', 1)[0]].add(name)
+
+    def remove(self, filename):
+        name = os.path.basename(filename)
+
+        if name not in self._files:
+            return
+
+        cached = self._files.pop(name)
+        self._inodes[cached.inode] -= 1
+
+        if not self._inodes[cached.inode]:
+            del self._inodes[cached.inode]
+            self._blob_paths.pop(cached.inode, None)
+            self.usage -= cached.size
+
+        del self._sorted[bisect.bisect_left(self._sorted, name)]
+
+        for mapping, key in ((self._stems, name.rsplit('.', 1)[0]), (self._generic, name.rsplit('-', 1)[0])):
+            mapping[key].discard(name)
+            if not mapping[key]:
+                del mapping[key]
+
+    def _resolve(self, names, url=None, touch=True):
+        """
+            Returns the path of the first of `names` that still exists, removing the ones that don't.  Unless `touch`
+            is False, this counts as a cache hit and a use of the file.
+        """
+        for name in sorted(names):
+            path = os.path.join(self.folder, name)
+
+            if os.path.isfile(path):
+                cached = self._files[name]
+                cached.url = url or cached.url
+
+                if touch:
+                    cached.accessed = time.time()
+                    self.hits += 1
+                    if cached.warmed:
+                        self.warm_hits += 1
+                        log.info("Warm hit: %s (%s of %s cache hits)", name, self.warm_hits, self.hits)
+
+                return path
+
+            log.info("%s was removed from the audio cache, updating the index", name)
+            self.remove(name)
+
+    def find(self, filename, url=None, touch=True):
+        name = os.path.basename(filename)
+        return self._resolve([name] if name in self._files else [], url, touch)
+
+    def find_stem(self, stem, url=None, touch=True):
+        return self._resolve(self._stems.get(stem, ()), url, touch)
+
+    def find_generic(self, stem, url=None, touch=True):
+        return self._resolve(self._generic.get(stem, ()), url, touch)
+
+    def find_prefix(self, prefix, url=None, touch=True):
+        names = []
+
+        for name in self._sorted[bisect.bisect_left(self._sorted, prefix):]:
+            if not name.startswith(prefix):
+                break
+
+            names.append(name)
+
+        return self._resolve(names, url, touch)
+
+    def mark_warmed(self, filename):
+        cached = self._files.get(os.path.basename(filename), None)
+        if cached:
+            cached.warmed = True
+
+    def size_of(self, filename):
+        cached = self._files.get(os.path.basename(filename), None)
+        return cached.size if cached else 0
+
+    async def store(self, loop, filename, url=None, digest=None, executor=None):
+        """
+            Adds a finished download to the index, replacing it with a link to its blob if the content is already
+            stored under another name.  `digest` is the sha256 of the file, if it's already known.
+        """
+        try:
+            blob, reclaimed = await loop.run_in_executor(executor, self._store_file, filename, url, digest)
+        except OSError:
+            log.exception("Could not move %s into the blob store", filename)
+            blob, reclaimed = None, 0
+
+        if reclaimed:
+            log.info("%s was already in the audio cache, saved %s KB", os.path.basename(filename), reclaimed // 1024)
+            self.deduplicated_bytes += reclaimed
+
+        self.add(filename, url=url)
+
+        cached = self._files.get(os.path.basename(filename), None)
+        if blob and cached:
+            self._blob_paths[cached.inode] = blob
+
+    def _store_file(self, filename, url, digest):
+        if url:
+            self._save_url(os.path.basename(filename), url)
+
+        return self.blobs.intern(filename, digest)
+
+    def _is_pinned(self, name, pinned):
+        return name in pinned or name.rsplit('.', 1)[0] in pinned or name.rsplit('-', 1)[0] in pinned
+
+    async def enforce_quota(self, loop, executor=None):
+        """
+            Deletes the lowest scoring files that aren't in use until the folder fits in the quota.
+        """
+        if not self.quota or self.usage <= self.quota or self._evicting:
+            return
+
+        self._evicting = True
+        try:
+            pinned = self.pinned()
+            candidates = [(name, cached) for name, cached in self._files.items() if not self._is_pinned(name, pinned)]
+
+            plays = [0] * len(candidates)
+            if self.play_counts and candidates:
+                try:
+                    counts = await self.play_counts([cached.url or '' for name, cached in candidates])
+                    plays = [int(count or 0) for count in counts]
+                except Exception:
+                    log.exception("Could not get play counts, evicting by last use only")
+
+            scored = sorted(
+                zip(candidates, plays),
+                key=lambda item: item[0][1].accessed + PLAY_WEIGHT * math.log2(1 + item[1])
+            )
+
+            victims = []
+            blobs = []
+            links = defaultdict(int)
+            freed = 0
+            for (name, cached), count in scored:
+                if self.usage - freed <= self.quota * EVICT_TO:
+                    break
+
+                victims.append(name)
+
+                # Space is only freed once every name linking to the content is gone.
+                links[cached.inode] += 1
+                if links[cached.inode] == self._inodes[cached.inode]:
+                    freed += cached.size
+                    if cached.inode in self._blob_paths:
+                        blobs.append(self._blob_paths[cached.inode])
+
+            deleted = await loop.run_in_executor(executor, self._delete, victims, blobs)
+
+            before = self.usage
+            for name in deleted:
+                self.remove(name)
+
+            freed = before - self.usage
+            self.evictions += len(deleted)
+            self.evicted_bytes += freed
+            log.info("Evicted %s files (%s MB) from %s", len(deleted), freed // 1024 ** 2, self.folder)
+        finally:
+            self._evicting = False
+
+    def _delete(self, names, blobs=()):
+        deleted = []
+
+        for name in names:
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                log.exception("Could not evict %s", name)
+                continue
+
+            deleted.append(name)
+
+            try:
+                os.remove(self._url_path(name))
+            except OSError:
+                pass
+
+        for blob in blobs:
+            try:
+                # A name that failed to be removed above still links to it, it gets collected on the next scan.
+                if os.stat(blob).st_nlink == 1:
+                    os.remove(blob)
+            except OSError:
+                pass
+
+        return deleted
+
+    def stats(self):
+        return {
+            "files": len(self._files),
+            "usage": self.usage,
+            "hits": self.hits,
+            "warm_hits": self.warm_hits,
+            "quota": self.quota,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+            "deduplicated_bytes": self.deduplicated_bytes
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deduplicates an audio cache folder by moving it into a blob store.")
+    parser.add_argument('folder', nargs='?', default='audio_cache', help="the audio cache folder (default: audio_cache)")
+    args = parser.parse_args()
+
+    store = BlobStore(os.path.join(args.folder, BLOB_FOLDER))
+    files, reclaimed = store.migrate(args.folder)
+
+    if not store.supported:
+        print("Hardlinks aren't supported in %s, nothing was deduplicated." % args.folder)
+    else:
+        print("Deduplicated %s files, reclaimed %.1f MB." % (files, reclaimed / 1024 ** 2))
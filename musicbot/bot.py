@@ -9,17 +9,18 @@ import aiohttp
 import asyncio
 import discord
 import raven
-import redis
 from discord.enums import ChannelType
 from discord.http import _func_
 from discord.voice_client import VoiceClient
 from musicbot import downloader, exceptions
 from musicbot.commands import all_commands
-from musicbot.connections import redis_pool
+from musicbot.lib.weighted_sampler import WeightedSampler
 from musicbot.player import MusicPlayer
+from musicbot.storage import Storage, WriteBehind
 from musicbot.playlist import Playlist
 from musicbot.structures import Response, SkipState
 from musicbot.utils import fixg, load_config, migrate_redis
+from musicbot.warmer import CacheWarmer
 
 # Logging
 logging.basicConfig(level=logging.INFO)
@@ -33,8 +34,7 @@ log = logging.getLogger(__name__)
 class MusicBot(discord.Client):
     def __init__(self):
         self.sentry = raven.Client(dsn=os.environ.get("SENTRY_DSN", None))
-        self.redis = redis.StrictRedis(connection_pool=redis_pool)
-        self.downloader = downloader.Downloader(download_folder='audio_cache')
+        self.storage = Storage()
 
         self.players = {}
         self.aiolocks = defaultdict(asyncio.Lock)
@@ -42,7 +42,8 @@ class MusicBot(discord.Client):
         self.init_ok = False
 
         load_config(self)
-        migrate_redis(self.redis)
+
+        self.downloader = downloader.Downloader(download_folder='audio_cache', config=self.config, storage=self.storage)
 
         # TODO: Do these properly
         ssd_defaults = {
@@ -53,6 +54,20 @@ class MusicBot(discord.Client):
 
         super().__init__()
         self.aiosession = aiohttp.ClientSession(loop=self.loop)
+        self.write_behind = WriteBehind(self.storage)
+
+        # Play counts for surprise picks, loaded on the first one and kept up to date by the playlists.
+        self.played_sampler = WeightedSampler(diminish=100)
+        self.downloader.audio_cache.pinned = self._audio_files_in_use
+        self.downloader.audio_cache.scan(self.loop, downloader.thread_pool)
+
+        self.warmer = CacheWarmer(
+            self,
+            songs=self.config.warmer_songs,
+            interval=self.config.warmer_interval,
+            bandwidth_budget=self.config.warmer_bandwidth * 1024 ** 2,
+            disk_budget=self.config.warmer_disk * 1024 ** 2
+        )
         self.http.user_agent += ' MusicBot/MODIFIED'
 
     def __del__(self):
@@ -216,6 +231,28 @@ class MusicBot(discord.Client):
 
         await self.ws.voice_state(vchannel.server.id, vchannel.id, mute, deaf)
 
+    def _audio_files_in_use(self):
+        """
+            Returns the names of the files that are playing or queued, which the audio cache must not evict.
+        """
+        names = set()
+
+        for player in self.players.values():
+            entries = list(player.playlist)
+            if player.current_entry:
+                entries.append(player.current_entry)
+
+            for entry in entries:
+                if entry.filename:
+                    names.add(os.path.basename(entry.filename))
+
+                if entry.expected_filename:
+                    name = os.path.basename(entry.expected_filename)
+                    names.add(name.rsplit('.', 1)[0])
+                    names.add(name.rsplit('-', 1)[0])
+
+        return names
+
     def get_player_in(self, server: discord.Server) -> MusicPlayer:
         return self.players.get(server.id, None)
 
@@ -239,6 +276,9 @@ class MusicBot(discord.Client):
                 player.skip_state = SkipState()
                 self.players[server.id] = player
 
+                # After the player is listening, so that it starts playing the restored queue.
+                await playlist.load_saved()
+
             async with self.aiolocks[self.reconnect_voice_client.__name__ + ':' + server.id]:
                 if self.players[server.id].voice_client not in self.voice_clients:
                     log.info("oh no reconnect needed")
@@ -340,6 +380,13 @@ class MusicBot(discord.Client):
         except: # Can be ignored
             pass
 
+        self.warmer.stop()
+        self.write_behind.close()
+        self.storage.close()
+
+        if self.downloader.process_extractor:
+            self.downloader.process_extractor.shutdown()
+
         pending = asyncio.Task.all_tasks()
         gathered = asyncio.gather(*pending)
 
@@ -353,6 +400,7 @@ class MusicBot(discord.Client):
     # noinspection PyMethodOverriding
     def run(self):
         try:
+            self.loop.run_until_complete(self.storage.call(migrate_redis))
             self.loop.run_until_complete(self.start(*self.config.auth))
         except discord.errors.LoginFailure:
             # Add if token, else
@@ -473,6 +521,8 @@ class MusicBot(discord.Client):
 
         await self._join_startup_channels(autojoin_channels)
 
+        self.warmer.start()
+
         # t-t-th-th-that's all folks!
 
     async def on_message(self, message):
@@ -553,8 +603,8 @@ class MusicBot(discord.Client):
             if params.pop('leftover_args', None):
                 handler_kwargs['leftover_args'] = args
 
-            if params.pop('redis', None):
-                handler_kwargs['redis'] = self.redis
+            if params.pop('storage', None):
+                handler_kwargs['storage'] = self.storage
 
             args_expected = []
             for key, param in list(params.items()):
@@ -178,3 +178,24 @@ async def cmd_reloadconfig(bot):
     """
     load_config(bot)
     return Response(":ok_hand:", delete_after=20)
+
+
+@command("stats")
+@owner_only
+async def cmd_stats(self):
+    """
+    Usage:
+        {command_prefix}stats
+
+    Shows the cache and download counters.
+    """
+    lines = []
+
+    stats = self.downloader.stats()
+    stats["warmer"] = self.warmer.stats()
+    stats["queue_writes"] = self.write_behind.stats()
+
+    for section, counters in sorted(stats.items()):
+        lines.append("%s: %s" % (section, ", ".join("%s=%s" % item for item in sorted(counters.items()))))
+
+    return Response("```\n%s\n```" % "\n".join(lines), delete_after=60)
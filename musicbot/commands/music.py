@@ -9,10 +9,10 @@ from textwrap import dedent
 import asyncio
 import pytimeparse
 from musicbot.commands import command
-from musicbot.constants import DISCORD_MSG_CHAR_LIMIT
+from musicbot.constants import QUEUE_MODES
 from musicbot.exceptions import (CommandError, PermissionsError, RetryPlay,
                                  WrongEntryTypeError)
-from musicbot.structures import Response
+from musicbot.structures import ImportProgress, Response
 from musicbot.utils import fixg, sane_round_int
 
 log = logging.getLogger(__name__)
@@ -57,11 +57,10 @@ async def cmd_play(self, player, channel, author, permissions, leftover_args, so
     # our ytdl options allow us to use search strings as input urls
     if info.get('url', '').startswith('ytsearch'):
         # log.info("[Command:play] Searching for \"%s\"" % song_url)
-        info = await self.downloader.extract_info(
+        info = await self.downloader.extract_search(
             player.playlist.loop,
-            song_url,
-            download=False,
-            process=True,    # ASYNC LAMBDAS WHEN
+            info['url'],
+            # ASYNC LAMBDAS WHEN
             on_error=lambda e: asyncio.ensure_future(
                 self.safe_send_message(channel, "```\n%s\n```" % e, expire_in=120), loop=self.loop),
             retry_on_error=True
@@ -136,7 +135,8 @@ async def cmd_play(self, player, channel, author, permissions, leftover_args, so
         # TODO: I can create an event emitter object instead, add event functions, and every play list might be asyncified
         #       Also have a "verify_entry" hook with the entry as an arg and returns the entry if its ok
 
-        entry_list, position = await player.playlist.import_from(song_url, channel=channel, author=author)
+        entry_list, position = await player.playlist.import_from(
+            song_url, max_duration=permissions.max_song_length, channel=channel, author=author)
 
         tnow = time.time()
         ttime = tnow - t0
@@ -144,10 +144,9 @@ async def cmd_play(self, player, channel, author, permissions, leftover_args, so
         drop_count = 0
 
         if permissions.max_song_length:
-            for e in entry_list.copy():
+            for e in entry_list:
                 if e.duration > permissions.max_song_length:
-                    player.playlist.entries.remove(e)
-                    entry_list.remove(e)
+                    player.playlist.remove_entry(e)
                     drop_count += 1
                     # Im pretty sure there's no situation where this would ever break
                     # Unless the first entry starts being played, which would make this a race condition
@@ -231,11 +230,13 @@ async def play_playlist_async(self, player, channel, author, permissions, playli
     busymsg = await self.safe_send_message(
         channel, "Processing %s songs..." % num_songs)  # TODO: From playlist_title
 
-    entries_added = 0
+    entries_added = []
+    progress = ImportProgress(num_songs)
     if extractor_type == 'youtube:playlist':
         try:
             entries_added = await player.playlist.async_process_youtube_playlist(
-                playlist_url, channel=channel, author=author)
+                playlist_url, progress=progress, max_duration=permissions.max_song_length, channel=channel,
+                author=author)
             # TODO: Add hook to be called after each song
             # TODO: Add permissions
 
@@ -247,7 +248,8 @@ async def play_playlist_async(self, player, channel, author, permissions, playli
     elif extractor_type.lower() in ['soundcloud:set', 'bandcamp:album']:
         try:
             entries_added = await player.playlist.async_process_sc_bc_playlist(
-                playlist_url, channel=channel, author=author)
+                playlist_url, progress=progress, max_duration=permissions.max_song_length, channel=channel,
+                author=author)
             # TODO: Add hook to be called after each song
             # TODO: Add permissions
 
@@ -262,14 +264,17 @@ async def play_playlist_async(self, player, channel, author, permissions, playli
     skipped = False
 
     if permissions.max_song_length:
-        for e in entries_added.copy():
+        kept = []
+        for e in entries_added:
             if e.duration > permissions.max_song_length:
                 try:
-                    player.playlist.entries.remove(e)
-                    entries_added.remove(e)
+                    player.playlist.remove_entry(e)
                     drop_count += 1
-                except:
-                    pass
+                except ValueError:
+                    kept.append(e)
+            else:
+                kept.append(e)
+        entries_added = kept
 
         if drop_count:
             log.info("Dropped %s songs" % drop_count)
@@ -290,9 +295,10 @@ async def play_playlist_async(self, player, channel, author, permissions, playli
     # TODO: actually calculate wait per song in the process function and return that too
 
     # This is technically inaccurate since bad songs are ignored but still take up time
-    log.info("Processed {}/{} songs in {} seconds at {:.2f}s/song, {:+.2g}/song from expected ({}s)".format(
+    log.info("Processed {}/{} songs ({} failed) in {} seconds at {:.2f}s/song, {:+.2g}/song from expected ({}s)".format(
         songs_processed,
         num_songs,
+        progress.failed,
         fixg(ttime),
         ttime / num_songs,
         ttime / num_songs - wait_per_song,
@@ -387,7 +393,7 @@ async def cmd_search(self, player, channel, author, permissions, leftover_args):
     search_msg = await self.send_message(channel, "Searching for videos...")
 
     try:
-        info = await self.downloader.extract_info(player.playlist.loop, search_query, download=False, process=True)
+        info = await self.downloader.extract_search(player.playlist.loop, search_query)
 
     except Exception as e:
         await self.safe_edit_message(search_msg, str(e), send_if_fail=True)
@@ -523,6 +529,27 @@ async def cmd_shuffle(self, channel, player, leftover_args, seed=None):
     return Response("Shuffled playlist!", delete_after=15)
 
 
+@command("queuemode")
+async def cmd_queuemode(self, player, mode=None):
+    """
+    Usage:
+        {command_prefix}queuemode [fifo|roundrobin|fair]
+
+    Shows or changes the order songs are played in.  fifo plays them in the order they were queued,
+    roundrobin takes turns between the people who queued them and fair takes turns weighted by their QueueWeight.
+    """
+
+    if not mode:
+        return Response("The queue mode is **%s**." % player.playlist.mode, delete_after=20)
+
+    try:
+        player.playlist.set_mode(mode.lower())
+    except ValueError:
+        raise CommandError("Unknown queue mode %s, use one of: %s" % (mode, ', '.join(QUEUE_MODES)), expire_in=20)
+
+    return Response("The queue mode is now **%s**." % player.playlist.mode, delete_after=20)
+
+
 @command("clear")
 async def cmd_clear(self, player, author):
     """
@@ -659,9 +686,10 @@ async def cmd_volume(self, message, player, new_volume=None):
 async def cmd_queue(self, channel, player, sendas=None):
     """
     Usage:
-        {command_prefix}queue
+        {command_prefix}queue [page]
+        {command_prefix}queue full
 
-    Prints the current song queue.
+    Prints a page of the current song queue, or sends the whole queue as a file.
     """
 
     if sendas:
@@ -670,8 +698,6 @@ async def cmd_queue(self, channel, player, sendas=None):
         sendall = False
 
     lines = []
-    unlisted = 0
-    andmoretext = '* ... and %s more*' % ('x' * len(player.playlist.entries))
 
     if player.current_entry:
         song_progress = str(timedelta(seconds=player.progress)).lstrip('0').lstrip(':')
@@ -684,23 +710,32 @@ async def cmd_queue(self, channel, player, sendas=None):
         else:
             lines.append("Now Playing: **%s** %s\n" % (player.current_entry.title, prog_str))
 
-    for i, item in enumerate(player.playlist, 1):
-        if item.meta.get('channel', False) and item.meta.get('author', False):
-            nextline = '`{}.` **{}** added by **{}**'.format(i, item.title, item.meta['author'].name).strip()
-        else:
-            nextline = '`{}.` **{}**'.format(i, item.title).strip()
+    if sendall:
+        with BytesIO() as data:
+            data.writelines(x.encode('utf8') + b'\n' for x in lines)
+            player.playlist.export(data)
+            data.seek(0)
+            return await self.send_file(
+                channel,
+                data,
+                filename='musicbot-full-queue.txt'
+            )
 
-        currentlinesum = sum(len(x) + 1 for x in lines)  # +1 is for newline char
+    try:
+        page = int(sendas) if sendas else 1
+    except ValueError:
+        raise CommandError('Invalid page number: %s' % sendas, expire_in=20)
+
+    pages = player.playlist.page_count
 
-        if (currentlinesum + len(nextline) + len(andmoretext) > DISCORD_MSG_CHAR_LIMIT) and not sendall:
-            if currentlinesum + len(andmoretext):
-                unlisted += 1
-                continue
+    if pages and not 1 <= page <= pages:
+        raise CommandError('The queue only has %s page%s.' % (pages, '' if pages == 1 else 's'), expire_in=20)
 
-        lines.append(nextline)
+    lines.extend(player.playlist.render_page(page))
 
-    if unlisted:
-        lines.append('\n*... and %s more*' % unlisted)
+    if pages > 1:
+        lines.append('\n*Page %s of %s (%s songs), use %squeue <page> for more*' % (
+            page, pages, len(player.playlist.entries), self.config.command_prefix))
 
     if not lines:
         lines.append(
@@ -708,16 +743,6 @@ async def cmd_queue(self, channel, player, sendas=None):
 
     message = '\n'.join(lines)
 
-    if sendall:
-        with BytesIO() as data:
-            data.writelines(x.encode('utf8') + b'\n' for x in lines)
-            data.seek(0)
-            return await self.send_file(
-                channel,
-                data,
-                filename='musicbot-full-queue.txt'
-            )
-
     return Response(message, delete_after=30)
 
 
@@ -1,30 +1,34 @@
-import functools
 import json
 
 import aiohttp
+import asyncio
 import billboard
 from concurrent.futures import ThreadPoolExecutor
 from musicbot.commands import command
 from musicbot.commands.music import cmd_play
 from musicbot.structures import Response
-from musicbot.utils import weighted_choice
 
 thread_pool = ThreadPoolExecutor(max_workers=2)
 
+# Held while the play counts are loaded into the surprise sampler.
+_sampler_lock = None
 
-def cache_billboard(redis):
-    if redis.exists("musicbot:chart:billboard"):
+
+async def cache_billboard(storage, loop):
+    if await storage.exists("musicbot:chart:billboard"):
         return
 
-    chart = billboard.ChartData('hot-100')
-    for song in chart:
-        redis.sadd("musicbot:chart", "%s %s" % (song.title, song.artist))
+    chart = await loop.run_in_executor(thread_pool, billboard.ChartData, 'hot-100')
+    songs = ["%s %s" % (song.title, song.artist) for song in chart]
+
+    if songs:
+        storage.sadd("musicbot:chart", *songs)
 
-    redis.setex("musicbot:chart:billboard", 86400, "1")
+    await storage.setex("musicbot:chart:billboard", 86400, "1")
 
 
-async def cache_soundcloud(redis, session):
-    if redis.exists("musicbot:chart:soundcloud"):
+async def cache_soundcloud(storage, session):
+    if await storage.exists("musicbot:chart:soundcloud"):
         return
 
     with aiohttp.Timeout(10):
@@ -36,19 +40,23 @@ async def cache_soundcloud(redis, session):
             except json.JSONDecodeError:
                 return
 
+            urls = []
             for song in parsed.get("collection", []):
                 track = song.get("track", {})
 
                 if "permalink_url" not in track or not track["permalink_url"]:
                     continue
 
-                redis.sadd("musicbot:chart", track["permalink_url"])
+                urls.append(track["permalink_url"])
+
+            if urls:
+                storage.sadd("musicbot:chart", *urls)
 
-    redis.setex("musicbot:chart:soundcloud", 86400, "1")
+    await storage.setex("musicbot:chart:soundcloud", 86400, "1")
 
 
-async def cache_apple(redis, session):
-    if redis.exists("musicbot:chart:apple"):
+async def cache_apple(storage, session):
+    if await storage.exists("musicbot:chart:apple"):
         return
 
     with aiohttp.Timeout(30):
@@ -62,37 +70,67 @@ async def cache_apple(redis, session):
             if "feed" not in parsed or "entry" not in parsed["feed"]:
                 return
 
+            labels = []
             for entry in parsed["feed"]["entry"]:
                 label = entry.get("title", {}).get("label", "")
 
                 if label == "":
                     continue
 
-                redis.sadd("musicbot:chart", label)
+                labels.append(label)
+
+            if labels:
+                storage.sadd("musicbot:chart", *labels)
+
+    await storage.setex("musicbot:chart:apple", 86400, "1")
+
+
+async def get_random_top(bot, storage):
+    await cache_billboard(storage, bot.loop)
+    await cache_soundcloud(storage, bot.aiosession)
+    await cache_apple(storage, bot.aiosession)
+
+    return await storage.srandmember("musicbot:chart")
+
+
+async def get_played_sampler(bot, storage):
+    """
+        Returns the bot's play count sampler, loading it from redis the first time.
+    """
+    global _sampler_lock
 
-    redis.setex("musicbot:chart:apple", 86400, "1")
+    sampler = bot.played_sampler
+    if sampler.loaded:
+        return sampler
 
+    if _sampler_lock is None:
+        _sampler_lock = asyncio.Lock()
 
-async def get_random_top(bot, redis):
-    await bot.loop.run_in_executor(thread_pool, functools.partial(cache_billboard, redis))
-    await cache_soundcloud(redis, bot.aiosession)
-    await cache_apple(redis, bot.aiosession)
+    with await _sampler_lock:
+        if not sampler.loaded:
+            # The plays counted so far are flushed ahead of the HGETALL (the storage thread runs things in order),
+            # the ones counted from here on are applied once loading is done.  Awaiting in between would let another
+            # flush slip in before the HGETALL and count its plays twice.
+            sampler.start_loading()
+            bot.write_behind.flush()
+            played = await storage.hgetall("musicbot:played")
+            built = await bot.loop.run_in_executor(thread_pool, sampler.build, played, sampler.diminish)
+            sampler.finish_loading(built)
 
-    return redis.srandmember("musicbot:chart")
+    return sampler
 
 
 @command("surprise")
-async def cmd_surprise(self, player, channel, author, permissions, redis, mode="fun"):
+async def cmd_surprise(self, player, channel, author, permissions, storage, mode="fun"):
 
-    if redis.exists("surpriserig"):
-        url = redis.spop("surpriserig")
+    if await storage.exists("surpriserig"):
+        url = await storage.spop("surpriserig")
     elif mode.lower() in ("serious", "whiteperson", "shit", "shitty", "pop", "popular", "bullshit", "horrible", "nickelback"):
-        url = await get_random_top(self, redis)
+        url = await get_random_top(self, storage)
     else:
-        urls = redis.hgetall("musicbot:played")
-        url = weighted_choice(urls, 100)
+        url = (await get_played_sampler(self, storage)).choice()
 
-    if mode == "prepend":
+    if url and mode == "prepend":
         url = "prepend:" + url
 
     if url:
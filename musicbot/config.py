@@ -70,6 +70,21 @@ class Config:
         self.now_playing_mentions = config.getboolean('MusicBot', 'NowPlayingMentions', fallback=ConfigDefaults.now_playing_mentions)
         self.delete_messages  = config.getboolean('MusicBot', 'DeleteMessages', fallback=ConfigDefaults.delete_messages)
         self.delete_invoking = config.getboolean('MusicBot', 'DeleteInvoking', fallback=ConfigDefaults.delete_invoking)
+        self.progressive_playback = config.getboolean('MusicBot', 'ProgressivePlayback', fallback=ConfigDefaults.progressive_playback)
+        self.audio_cache_size = config.getint('MusicBot', 'AudioCacheSize', fallback=ConfigDefaults.audio_cache_size)
+
+        self.extraction_backend = config.get('Extraction', 'Backend', fallback=ConfigDefaults.extraction_backend)
+        self.extraction_workers = config.getint('Extraction', 'Workers', fallback=ConfigDefaults.extraction_workers)
+        self.extraction_max_jobs = config.getint('Extraction', 'MaxJobsPerWorker', fallback=ConfigDefaults.extraction_max_jobs)
+        self.extraction_timeout = config.getfloat('Extraction', 'Timeout', fallback=ConfigDefaults.extraction_timeout)
+        self.search_cache_ttl = config.getint('Extraction', 'SearchCacheTTL', fallback=ConfigDefaults.search_cache_ttl)
+        self.download_workers = config.getint('Extraction', 'DownloadWorkers', fallback=ConfigDefaults.download_workers)
+        self.import_concurrency = config.getint('Extraction', 'ImportConcurrency', fallback=ConfigDefaults.import_concurrency)
+
+        self.warmer_songs = config.getint('Warmer', 'Songs', fallback=ConfigDefaults.warmer_songs)
+        self.warmer_interval = config.getint('Warmer', 'Interval', fallback=ConfigDefaults.warmer_interval)
+        self.warmer_bandwidth = config.getint('Warmer', 'BandwidthBudget', fallback=ConfigDefaults.warmer_bandwidth)
+        self.warmer_disk = config.getint('Warmer', 'DiskBudget', fallback=ConfigDefaults.warmer_disk)
 
         self.run_checks()
 
@@ -124,6 +139,19 @@ class Config:
 
         self.delete_invoking = self.delete_invoking and self.delete_messages
 
+        self.extraction_backend = self.extraction_backend.lower().strip()
+        if self.extraction_backend not in ('thread', 'process'):
+            print("[Warning] Extraction Backend must be either thread or process, using %s" % ConfigDefaults.extraction_backend)
+            self.extraction_backend = ConfigDefaults.extraction_backend
+
+        self.extraction_workers = max(1, self.extraction_workers)
+        self.extraction_max_jobs = max(1, self.extraction_max_jobs)
+        self.download_workers = max(1, self.download_workers)
+        self.import_concurrency = max(1, self.import_concurrency)
+        self.audio_cache_size = max(0, self.audio_cache_size)
+        self.warmer_songs = max(0, self.warmer_songs)
+        self.warmer_interval = max(10, self.warmer_interval)
+
         self.bound_channels = set(item.replace(',', ' ').strip() for item in self.bound_channels)
 
         self.autojoin_channels = set(item.replace(',', ' ').strip() for item in self.autojoin_channels)
@@ -143,5 +171,20 @@ class ConfigDefaults:
     now_playing_mentions = False
     delete_messages = True
     delete_invoking = False
+    progressive_playback = True
+    audio_cache_size = 0
+
+    extraction_backend = 'thread'
+    extraction_workers = 4
+    extraction_max_jobs = 50
+    extraction_timeout = 120.0
+    search_cache_ttl = 1800
+    download_workers = 2
+    import_concurrency = 8
+
+    warmer_songs = 0
+    warmer_interval = 300
+    warmer_bandwidth = 500
+    warmer_disk = 2048
 
     options_file = 'config/options.ini'
@@ -8,3 +8,10 @@ redis_pool = redis.ConnectionPool(
     db=int(os.environ.get("REDIS_DB", 0)),
     decode_responses=True
 )
+
+# Same server, but for values that aren't text (compressed info cache entries).
+redis_binary_pool = redis.ConnectionPool(
+    host=os.environ.get("REDIS_HOST", "localhost"),
+    port=int(os.environ.get("REDIS_PORT", 6379)),
+    db=int(os.environ.get("REDIS_DB", 0))
+)
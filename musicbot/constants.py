@@ -1 +1,8 @@
 DISCORD_MSG_CHAR_LIMIT = 2000
+
+# Songs per page of the queue command, and how much of a title it shows.  Ten full lines fit in a message.
+QUEUE_PAGE_SIZE = 10
+QUEUE_TITLE_LIMIT = 80
+
+# The orders a playlist can play its songs in, see `Playlist.set_mode`.
+QUEUE_MODES = ('fifo', 'roundrobin', 'fair')
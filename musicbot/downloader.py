@@ -1,13 +1,27 @@
 import functools
 import hashlib
 import json
+import logging
 import os
+import re
+import threading
+import zlib
+from collections import defaultdict
 
 import asyncio
-import redis
 import youtube_dl
-from concurrent.futures import ThreadPoolExecutor
-from musicbot.connections import redis_pool
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from musicbot.audiocache import AudioCacheIndex
+from musicbot.exceptions import ExtractionError
+from musicbot.lib.futures import share
+from musicbot.lib.lru_cache import MISSING, LRUCache, is_negative
+from musicbot.lib.scheduler import DeadlineScheduler
+from musicbot.lib.urls import canonicalize
+from musicbot.storage import Storage
+from musicbot.utils import md5sum
+
+log = logging.getLogger(__name__)
 
 ytdl_format_options = {
     'format': 'bestaudio/best',
@@ -30,6 +44,32 @@ youtube_dl.utils.bug_reports_message = lambda: ''
 
 thread_pool = ThreadPoolExecutor(max_workers=4)
 
+# Limits for the in-process tier that sits in front of the redis cache.
+MEMORY_CACHE_ENTRIES = 2048
+MEMORY_CACHE_BYTES = 32 * 1024 * 1024
+MEMORY_CACHE_TTL = 60 * 60
+MEMORY_CACHE_NEGATIVE_TTL = 30
+
+# Bulky info fields that nothing in the bot reads, these are dropped before an info dict leaves the extractor.
+trimmed_fields = {
+    'formats', 'thumbnails', 'subtitles', 'automatic_captions', 'requested_subtitles', 'annotations', 'description'
+}
+
+# Version of the info cache format, bump this when `cached_fields` changes.
+CACHE_VERSION = 2
+CACHE_TTL = 60 * 60 * 24 * 7
+
+# The only info fields kept in the redis cache, everything else gets dropped before storing.
+cached_fields = {
+    '_type', 'ie_key', 'extractor', 'extractor_key', 'id', 'url', 'webpage_url', 'title', 'duration', 'ext', 'entries'
+}
+
+# Matches the search strings youtube_dl understands, i.e. ytsearch3:some song
+search_query = re.compile(r'^(?P<service>[a-z]+search)(?P<count>\d+|all)?:(?P<query>.*)$', re.I | re.S)
+
+# The info fields used to fill in the output template, see `Downloader.prepare_filename`.
+outtmpl_fields = re.findall(r'%\((\w+)\)', ytdl_format_options['outtmpl'])
+
 '''
     Alright, here's the problem.  To catch youtube-dl errors for their useful information, I have to
     catch the exceptions with `ignoreerrors` off.  To not break when ytdl hits a dumb video
@@ -38,19 +78,29 @@ thread_pool = ThreadPoolExecutor(max_workers=4)
 
 '''
 
-class Downloader:
+class YoutubeDLPool:
+    """
+        Hands out YoutubeDL objects, keeping one safe and one unsafe instance per worker thread.
+
+        Constructing a YoutubeDL object sets up every extractor, so they are built once per thread and reused for
+        every call made from that thread afterwards.
+    """
+
     def __init__(self, download_folder=None):
         self.download_folder = download_folder
+        self._local = threading.local()
 
-    @property
-    def ytdl(self):
-        return self.get_ytdl(safe=True)
+    def get(self, safe=False):
+        attr = "safe" if safe else "unsafe"
 
-    @property
-    def redis(self):
-        return redis.StrictRedis(connection_pool=redis_pool)
+        ytdl = getattr(self._local, attr, None)
+        if ytdl is None:
+            ytdl = self.build(safe)
+            setattr(self._local, attr, ytdl)
 
-    def get_ytdl(self, safe=False):
+        return ytdl
+
+    def build(self, safe=False):
         ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
         if safe:
             ytdl.params['ignoreerrors'] = True
@@ -61,6 +111,311 @@ class Downloader:
 
         return ytdl
 
+
+class ContentHasher:
+    """
+        A youtube_dl progress hook that hashes a download while it's being written, by reading back whatever was
+        added to the file since the last progress report.  The data was just written, so it comes from the page cache
+        instead of the disk.
+
+        The file is hashed with md5 (for generic download names) and sha256 (for the blob store) in the same pass.
+        `hexdigest` returns None when the hashes don't cover exactly the finished file (the download restarted, or
+        the downloader doesn't report progress), in which case the file has to be hashed after all.
+    """
+
+    # Progress is reported for every block, so the file is only read back once this much has been added.
+    read_every = 1024 * 1024
+
+    algorithms = ('md5', 'sha256')
+
+    def __init__(self):
+        self._hashes = [hashlib.new(name) for name in self.algorithms]
+        self._offset = 0
+        self._filename = None
+        self._valid = True
+
+    def __call__(self, status):
+        if status['status'] == 'downloading':
+            if status.get('downloaded_bytes', 0) - self._offset >= self.read_every:
+                self._read(status.get('tmpfilename', None))
+
+        elif status['status'] == 'finished':
+            self._read(status.get('filename', None))
+            self._filename = status.get('filename', None)
+
+        else:
+            self._valid = False
+
+    def _read(self, filename):
+        if not filename or filename == '-':
+            self._valid = False
+            return
+
+        try:
+            with open(filename, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() < self._offset:
+                    # The file was started over.
+                    self._hashes = [hashlib.new(name) for name in self.algorithms]
+                    self._offset = 0
+
+                f.seek(self._offset)
+                for chunk in iter(lambda: f.read(self.read_every), b''):
+                    for fhash in self._hashes:
+                        fhash.update(chunk)
+                    self._offset += len(chunk)
+        except OSError:
+            self._valid = False
+
+    def hexdigest(self, name):
+        try:
+            if self._valid and self._filename and os.path.getsize(self._filename) == self._offset:
+                return self._hashes[self.algorithms.index(name)].hexdigest()
+        except OSError:
+            pass
+
+        return None
+
+
+def trim_info(data):
+    """
+        Returns a copy of an info dict that only contains plain (json and pickle safe) types, without the fields in
+        `trimmed_fields`.  Lazy playlist entries are read into lists.
+    """
+    if isinstance(data, dict):
+        trimmed = {}
+
+        for key, value in data.items():
+            if key in trimmed_fields:
+                continue
+
+            value = trim_info(value)
+            if value is not _unsupported:
+                trimmed[key] = value
+
+        return trimmed
+
+    elif isinstance(data, (str, int, float, bool)) or data is None:
+        return data
+
+    elif hasattr(data, 'getslice'):
+        # youtube_dl's PagedList
+        data = data.getslice()
+
+    elif not hasattr(data, '__iter__') or isinstance(data, bytes):
+        return _unsupported
+
+    return [item for item in map(trim_info, data) if item is not _unsupported]
+
+
+_unsupported = object()
+
+
+def project_info(info):
+    """
+        Returns a copy of an info dict with only the `cached_fields`, playlist entries included.
+    """
+    projected = {}
+
+    for key in cached_fields.intersection(info):
+        value = info[key]
+
+        if key == 'entries' and value is not None:
+            value = [project_info(entry) if isinstance(entry, dict) else entry for entry in value]
+
+        projected[key] = value
+
+    return projected
+
+
+def encode_info(info):
+    """
+        Returns the compressed json of an info dict and the length of the json, which is what the memory cache is
+        charged for it (the compressed size is a fraction of what the dict takes up).
+    """
+    data = json.dumps(info, separators=(',', ':')).encode('utf8')
+    return zlib.compress(data), len(data)
+
+
+def decode_info(payload):
+    """
+        Returns the info dict from `encode_info`'s compressed json and the length of the json.
+    """
+    data = zlib.decompress(payload)
+    return json.loads(data.decode('utf8')), len(data)
+
+# YoutubeDLPools used inside of the extraction worker processes, keyed by download folder.
+_worker_pools = {}
+
+
+def _extract_in_worker(download_folder, url, safe, kwargs):
+    pool = _worker_pools.get(download_folder, None)
+    if pool is None:
+        pool = _worker_pools[download_folder] = YoutubeDLPool(download_folder)
+
+    try:
+        return trim_info(pool.get(safe).extract_info(url, **kwargs))
+    except Exception as e:
+        # youtube_dl's exceptions hold on to tracebacks which can't be pickled back to the bot.
+        raise ExtractionError(str(e))
+
+
+class ProcessExtractor:
+    """
+        Runs metadata extractions in a pool of worker processes so that youtube_dl's parsing doesn't hold the GIL of
+        the bot process.
+
+        The pool is replaced after roughly `max_jobs` extractions per worker to keep memory growth in check, and
+        killed and replaced when an extraction runs past `timeout` seconds.
+    """
+
+    def __init__(self, download_folder=None, workers=4, max_jobs=50, timeout=120):
+        self.download_folder = download_folder
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+
+        self._executor = None
+        self._jobs = 0
+
+    def _get_executor(self):
+        if self._executor is None or self._jobs >= self.workers * self.max_jobs:
+            self._retire()
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._jobs = 0
+
+        self._jobs += 1
+        return self._executor
+
+    def _retire(self, executor=None, kill=False):
+        """
+            Stops handing out `executor` (the current one by default).  Its workers exit once they've finished the
+            work they already have, or right away if `kill` is set.
+        """
+        executor = executor or self._executor
+        if executor is None:
+            return
+
+        if executor is self._executor:
+            self._executor = None
+
+        if kill:
+            # There is no public api to stop a stuck worker.
+            for process in list((executor._processes or {}).values()):
+                process.terminate()
+
+        executor.shutdown(wait=False)
+
+    async def extract_info(self, loop, url, safe=False, **kwargs):
+        # One retry, in case the job was caught up in another job's worker being killed.
+        for attempt in range(2):
+            executor = self._get_executor()
+            future = loop.run_in_executor(
+                executor, functools.partial(_extract_in_worker, self.download_folder, url, safe, kwargs))
+
+            try:
+                return await asyncio.wait_for(future, self.timeout)
+
+            except asyncio.TimeoutError:
+                log.warning("Extraction of %s took longer than %ss, replacing the worker pool", url, self.timeout)
+                self._retire(executor, kill=True)
+                raise ExtractionError("Looking up %s took too long." % url)
+
+            except BrokenProcessPool:
+                log.warning("Extraction worker pool broke while extracting %s", url)
+                self._retire(executor)
+
+        raise ExtractionError("Could not look up %s, the extraction worker died." % url)
+
+    def shutdown(self):
+        self._retire(kill=True)
+
+
+class Downloader:
+    def __init__(self, download_folder=None, config=None, storage=None):
+        self.download_folder = download_folder
+        self.storage = storage or Storage()
+        self.ytdl_pool = YoutubeDLPool(download_folder)
+        self.audio_cache = AudioCacheIndex(
+            download_folder or os.curdir,
+            quota=(config.audio_cache_size if config else 0) * 1024 ** 2,
+            play_counts=lambda urls: self.storage.hmget("musicbot:played", urls)
+        )
+
+        if config and config.extraction_backend == 'process':
+            self.process_extractor = ProcessExtractor(
+                download_folder,
+                workers=config.extraction_workers,
+                max_jobs=config.extraction_max_jobs,
+                timeout=config.extraction_timeout
+            )
+        else:
+            self.process_extractor = None
+
+        self.search_cache_ttl = config.search_cache_ttl if config else 0
+
+        # Downloads get their own workers so that lookups can't starve them and vice versa.
+        download_workers = config.download_workers if config else 2
+        self.download_pool = ThreadPoolExecutor(max_workers=download_workers)
+        self.scheduler = DeadlineScheduler(max_concurrent=download_workers)
+
+        self.memory_cache = LRUCache(
+            max_entries=MEMORY_CACHE_ENTRIES,
+            max_bytes=MEMORY_CACHE_BYTES,
+            ttl=MEMORY_CACHE_TTL,
+            negative_ttl=MEMORY_CACHE_NEGATIVE_TTL
+        )
+
+        # Extractions that are currently running, keyed by (url, process, download, safe, cache).
+        self._inflight = {}
+
+    @property
+    def ytdl(self):
+        return self.get_ytdl(safe=True)
+
+    def get_ytdl(self, safe=False):
+        return self.ytdl_pool.get(safe)
+
+    def prepare_filename(self, info):
+        """
+            Returns the same file name as `YoutubeDL.prepare_filename` would for our output template, without
+            having to build a YoutubeDL object.
+        """
+        template = defaultdict(lambda: 'NA')
+
+        for field in outtmpl_fields:
+            value = info.get(field, None)
+
+            if value is None or isinstance(value, (list, tuple, dict)):
+                continue
+
+            if not isinstance(value, (int, float)):
+                value = youtube_dl.utils.sanitize_filename(
+                    str(value),
+                    restricted=ytdl_format_options['restrictfilenames'],
+                    is_id=(field == 'id' or field.endswith('_id'))
+                )
+
+            template[field] = value
+
+        filename = ytdl_format_options['outtmpl'] % template
+
+        if self.download_folder:
+            filename = os.path.join(self.download_folder, filename)
+
+        return filename
+
+    # noinspection PyShadowingBuiltins
+    def filename_prefix(self, extractor, id):
+        """
+            Returns the `extractor-id-` start of the file names from `prepare_filename`, which doesn't change when a
+            video is renamed.
+        """
+        return '%s-%s-' % (
+            youtube_dl.utils.sanitize_filename(str(extractor), restricted=ytdl_format_options['restrictfilenames']),
+            youtube_dl.utils.sanitize_filename(str(id), restricted=ytdl_format_options['restrictfilenames'], is_id=True)
+        )
+
     def hash_string(self, data):
         if isinstance(data, str):
             data = data.encode("utf8")
@@ -69,46 +424,253 @@ class Downloader:
         m.update(data)
         return m.hexdigest()
 
-    def set_cache(self, url, data, **kwargs):
-        cachekey = "musicbot:cache:" + self.hash_string(url)
+    def normalize_url(self, url):
+        return canonicalize(url)
 
-        # Do not cache searches on YouTube.
-        if "url" in data and data["url"].startswith("ytsearch"):
-            return None
+    def cache_key(self, url, version=CACHE_VERSION, **kwargs):
+        if version == 1:
+            # The old entries were written under the url as it was given, not its canonical form.
+            cachekey = "musicbot:cache:" + self.hash_string(url)
+        else:
+            cachekey = "musicbot:cache:v%s:" % version + self.hash_string(self.normalize_url(url))
 
         if "process" in kwargs and kwargs["process"] is True:
             cachekey += ":processed"
 
+        return cachekey
+
+    async def set_cache(self, url, data, **kwargs):
+        cachekey = self.cache_key(url, **kwargs)
+
+        # Search results go in the search cache, see `extract_search`.
+        if "url" in data and data["url"].startswith("ytsearch"):
+            return None
+
+        if ":search" in data.get("extractor", ""):
+            return None
+
+        data = project_info(data)
+
         try:
-            self.redis.setex(cachekey, 60 * 60 * 24 * 7, json.dumps(data))
+            # Playlists make for big payloads, keep compressing them off the loop.
+            payload, size = await self.storage.loop.run_in_executor(thread_pool, encode_info, data)
         except TypeError:
-            pass
+            return
+
+        await self.storage.setex(cachekey, CACHE_TTL, payload, binary=True)
+        self.memory_cache.set(cachekey, data, size=size)
+        return data
 
-    def get_cache(self, url, **kwargs):
-        cachekey = "musicbot:cache:" + self.hash_string(url)
+    async def get_cache(self, url, **kwargs):
+        cachekey = self.cache_key(url, **kwargs)
 
         # Don't hit the cache if we are downloading the video.
         if "download" in kwargs and kwargs["download"] is True:
             return None
 
-        if "process" in kwargs and kwargs["process"] is True:
-            cachekey += ":processed"
-
         try:
-            _data = self.redis.get(cachekey)
+            _data = await self.storage.get(cachekey, binary=True)
 
             if not _data:
-                return
+                return await self._migrate_cache(url, **kwargs)
 
-            data = json.loads(_data)
+            data, size = await self.storage.loop.run_in_executor(thread_pool, decode_info, _data)
             if data:
+                self.memory_cache.set(cachekey, data, size=size)
                 return data
-        except json.JSONDecodeError:
+        except (zlib.error, UnicodeDecodeError, json.JSONDecodeError):
+            return None
+
+    async def _migrate_cache(self, url, **kwargs):
+        """
+            Moves an info dict cached in the old, uncompressed json format over to the current format.
+        """
+        oldkey = self.cache_key(url, version=1, **kwargs)
+
+        _data = await self.storage.get(oldkey)
+        if not _data:
             return None
 
+        try:
+            data = json.loads(_data)
+        except json.JSONDecodeError:
+            data = None
+
+        migrated = await self.set_cache(url, data, **kwargs) if data else None
+
+        # Only old entries that were there get deleted, a miss in the current format doesn't cost another command.
+        self.storage.delete(oldkey)
+        return migrated
+
     def _extract_info(self, *args, safe=False, **kwargs):
         ytdl = self.get_ytdl(safe)
-        return ytdl.extract_info(*args, **kwargs)
+        return trim_info(ytdl.extract_info(*args, **kwargs))
+
+    def _download_info(self, *args, safe=False, content_hash=False, **kwargs):
+        if not content_hash:
+            return self._extract_info(*args, safe=safe, **kwargs)
+
+        ytdl = self.get_ytdl(safe)
+        hasher = ContentHasher()
+
+        # The YoutubeDL object belongs to this thread, so nothing else downloads through it while the hook is on.
+        ytdl.add_progress_hook(hasher)
+        try:
+            info = trim_info(ytdl.extract_info(*args, **kwargs))
+        finally:
+            ytdl._progress_hooks.remove(hasher)
+
+        if info:
+            info['content_md5'] = hasher.hexdigest('md5')
+            info['content_sha256'] = hasher.hexdigest('sha256')
+
+        return info
+
+    async def _cached_extract_info(self, loop, *args, safe=False, cache=True, content_hash=False, **kwargs):
+        """
+            Looks the url up in the in-memory cache, then redis and finally runs the extraction in the threadpool.
+            Empty results and extraction errors are remembered for a short while so they aren't retried right away.
+            Concurrent calls for the same url share a single lookup.
+
+            Passing `cache=False` skips the cache lookups, for when fresh data is needed (direct media urls expire).
+            Passing `content_hash=True` with `download=True` hashes the file while it downloads, the hex digests end
+            up in the `content_md5` and `content_sha256` fields of the result (None if they couldn't be worked out on
+            the fly).
+        """
+        if cache and not kwargs.get("download", False):
+            info = self.memory_cache.get(self.cache_key(args[0], **kwargs))
+
+            if is_negative(info):
+                if info is MISSING:
+                    return None
+
+                # Safe extractions ignore errors, so a failed normal extraction doesn't tell us anything.
+                if not safe:
+                    raise info.exception
+
+            elif info:
+                return info
+
+        key = (
+            self.normalize_url(args[0]),
+            kwargs.get("process", None),
+            kwargs.get("download", None),
+            safe,
+            cache,
+            content_hash
+        )
+
+        future = self._inflight.get(key, None)
+        if future is None:
+            future = asyncio.ensure_future(
+                self._resolve_info(loop, *args, safe=safe, cache=cache, content_hash=content_hash, **kwargs), loop=loop)
+            future.add_done_callback(functools.partial(self._inflight_done, key))
+            self._inflight[key] = future
+
+        return await share(future)
+
+    def _inflight_done(self, key, future):
+        if self._inflight.get(key, None) is future:
+            del self._inflight[key]
+
+    async def _resolve_info(self, loop, *args, safe=False, cache=True, content_hash=False, **kwargs):
+        cacheable = not kwargs.get("download", False)
+        cachekey = self.cache_key(args[0], **kwargs)
+
+        if cacheable and cache:
+            info = await self.get_cache(args[0], **kwargs)
+            if info:
+                return info
+
+        try:
+            # Downloads always stay in the bot process, only metadata lookups are moved out of it.
+            if not cacheable:
+                info = await loop.run_in_executor(
+                    self.download_pool,
+                    functools.partial(self._download_info, *args, safe=safe, content_hash=content_hash, **kwargs)
+                )
+            elif self.process_extractor:
+                info = await self.process_extractor.extract_info(loop, *args, safe=safe, **kwargs)
+            else:
+                info = await loop.run_in_executor(
+                    thread_pool, functools.partial(self._extract_info, *args, safe=safe, **kwargs))
+        except Exception as e:
+            if cacheable:
+                self.memory_cache.set_negative(cachekey, e)
+            raise
+
+        if info:
+            asyncio.ensure_future(self.set_cache(args[0], info, **kwargs), loop=loop)
+        elif cacheable and not safe:
+            # A safe extraction comes back empty when it failed, a normal one would have raised the actual error.
+            self.memory_cache.set_negative(cachekey)
+
+        return info
+
+    def search_cache_key(self, query):
+        """
+            Returns the redis key for a search string, or None if it isn't a search.
+        """
+        match = search_query.match(query.strip())
+        if not match:
+            return None
+
+        # Searches for "Never gonna  give you UP" and "never gonna give you up" are the same search.
+        text = ' '.join(match.group('query').lower().split())
+
+        return "musicbot:search:%s:%s:%s" % (
+            match.group('service').lower(),
+            (match.group('count') or '1').lower(),
+            self.hash_string(text)
+        )
+
+    async def get_search_cache(self, query):
+        cachekey = self.search_cache_key(query)
+        if not cachekey or not self.search_cache_ttl:
+            return None
+
+        try:
+            data = await self.storage.get(cachekey)
+            if data:
+                return json.loads(data)
+        except json.JSONDecodeError:
+            return None
+
+    def set_search_cache(self, query, info):
+        cachekey = self.search_cache_key(query)
+        if not cachekey or not self.search_cache_ttl:
+            return
+
+        self.storage.setex(cachekey, self.search_cache_ttl, json.dumps(info))
+
+    async def extract_search(self, loop, query, **kwargs):
+        """
+            Runs a search string (ytsearch3:some song) through `extract_info`, remembering the results for a short
+            while.  Only the ids, titles, durations and urls of the results are kept.
+        """
+        info = await self.get_search_cache(query)
+        if info:
+            return info
+
+        info = await self.extract_info(loop, query, download=False, process=True, **kwargs)
+        if not info:
+            return info
+
+        info = {
+            "_type": "playlist",
+            "extractor": info.get("extractor", "search"),
+            "entries": [{
+                "id": entry.get("id", None),
+                "title": entry.get("title", None),
+                "duration": entry.get("duration", None),
+                "webpage_url": entry.get("webpage_url", entry.get("url", None))
+            } for entry in info.get("entries", []) if entry]
+        }
+
+        if info["entries"]:
+            self.set_search_cache(query, info)
+
+        return info
 
     async def extract_info(self, loop, *args, on_error=None, retry_on_error=False, **kwargs):
         """
@@ -117,15 +679,9 @@ class Downloader:
             on_error as an argument.
         """
 
-        info = await loop.run_in_executor(thread_pool, functools.partial(self.get_cache, args[0], **kwargs))
-        if info:
-            return info
-
         if callable(on_error):
             try:
-                info = await loop.run_in_executor(thread_pool, functools.partial(self._extract_info, *args, **kwargs))
-                loop.run_in_executor(thread_pool, functools.partial(self.set_cache, args[0], info, **kwargs))
-                return info
+                return await self._cached_extract_info(loop, *args, **kwargs)
             except Exception as e:
 
                 # (youtube_dl.utils.ExtractorError, youtube_dl.utils.DownloadError)
@@ -142,15 +698,60 @@ class Downloader:
                 if retry_on_error:
                     return await self.safe_extract_info(loop, *args, **kwargs)
         else:
-            info = await loop.run_in_executor(thread_pool, functools.partial(self._extract_info, *args, **kwargs))
-            loop.run_in_executor(thread_pool, functools.partial(self.set_cache, args[0], info, **kwargs))
-            return info
+            return await self._cached_extract_info(loop, *args, **kwargs)
 
     async def safe_extract_info(self, loop, *args, **kwargs):
-        info = await loop.run_in_executor(thread_pool, functools.partial(self.get_cache, args[0], **kwargs))
-        if info:
-            return info
+        return await self._cached_extract_info(loop, *args, safe=True, **kwargs)
 
-        info = await loop.run_in_executor(thread_pool, functools.partial(self._extract_info, safe=True, *args, **kwargs))
-        loop.run_in_executor(thread_pool, functools.partial(self.set_cache, args[0], info, **kwargs))
-        return info
+    # noinspection PyShadowingBuiltins
+    async def download(self, loop, url, hash=False):
+        """
+            Downloads `url` into the audio cache and returns the path of the file.
+
+            With `hash=True` the last 8 characters of the file's md5 are put in front of the extension, for sites
+            whose urls don't make for unique names (generic downloads).
+        """
+        try:
+            result = await self.extract_info(loop, url, download=True, content_hash=True)
+        except Exception as e:
+            raise ExtractionError(e)
+
+        if result is None:
+            raise ExtractionError("ytdl broke and hell if I know why")
+            # What the fuck do I do now?
+
+        filename = unhashed_fname = self.prepare_filename(result)
+
+        if hash:
+            # The file is normally hashed while it downloads, this is only the fallback.
+            digest = result.get('content_md5', None)
+            if not digest:
+                digest = await loop.run_in_executor(thread_pool, md5sum, unhashed_fname)
+
+            # insert the 8 last characters of the file hash to the file name to ensure uniqueness
+            filename = digest[-8:].join('-.').join(unhashed_fname.rsplit('.', 1))
+
+            if os.path.isfile(filename):
+                # Oh bother it was actually there.
+                os.unlink(unhashed_fname)
+            else:
+                # Move the temporary file to it's final location.
+                os.rename(unhashed_fname, filename)
+
+        await self.audio_cache.store(
+            loop,
+            filename,
+            url=canonicalize(url),
+            digest=result.get('content_sha256', None),
+            executor=thread_pool
+        )
+        asyncio.ensure_future(self.audio_cache.enforce_quota(loop), loop=loop)
+
+        return filename
+
+    def stats(self):
+        return {
+            "memory_cache": self.memory_cache.stats(),
+            "downloads": self.scheduler.stats(),
+            "audio_cache": self.audio_cache.stats()
+        }
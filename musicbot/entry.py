@@ -2,19 +2,109 @@ import json
 import logging
 import os
 import traceback
+import weakref
 
 import asyncio
 from musicbot.exceptions import ExtractionError
-from musicbot.utils import get_header, md5sum
+from musicbot.lib.urls import canonicalize
+from musicbot.utils import get_header
 
 log = logging.getLogger(__name__)
 
 
+class Track:
+    """
+        The song an entry plays.  Immutable and shared by every entry of the same song in every server, get one with
+        `Track.get`.
+    """
+    __slots__ = ('url', 'title', 'duration', 'expected_filename', 'extractor', 'id', '__weakref__')
+
+    _tracks = weakref.WeakValueDictionary()
+
+    # noinspection PyShadowingBuiltins
+    def __init__(self, url, title, duration, expected_filename, extractor, id):
+        for name, value in zip(self.__slots__, (url, title, duration, expected_filename, extractor, id)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Tracks can't be changed")
+
+    # noinspection PyShadowingBuiltins
+    @classmethod
+    def get(cls, url, title, duration=0, expected_filename=None, extractor=None, id=None):
+        key = (url, title, duration, expected_filename, extractor, id)
+
+        track = cls._tracks.get(key, None)
+        if track is None:
+            track = cls(*key)
+            cls._tracks[key] = track
+
+        return track
+
+
+class EntryMeta:
+    """
+        The `meta` mapping of an entry.  The author and channel are kept on the entry as ids and looked up when asked
+        for, keys other than author, channel, seek and quiet go into a dict that is only made when one is set.
+    """
+    __slots__ = ('entry',)
+
+    _missing = object()
+
+    def __init__(self, entry):
+        self.entry = entry
+
+    def get(self, key, default=None):
+        entry = self.entry
+
+        if key == 'author':
+            value = entry.author
+        elif key == 'channel':
+            value = entry.channel
+        elif key == 'seek':
+            value = entry.seek
+        elif key == 'quiet':
+            value = entry.quiet
+        else:
+            value = entry.extra_meta.get(key, None) if entry.extra_meta else None
+
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key, self._missing)
+        if value is self._missing:
+            raise KeyError(key)
+
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, self._missing) is not self._missing
+
+    def __setitem__(self, key, value):
+        entry = self.entry
+
+        if key == 'author':
+            entry.author_id = value.id if value else None
+        elif key == 'channel':
+            entry.channel_id = value.id if value else None
+        elif key in ('seek', 'quiet'):
+            setattr(entry, key, value)
+        else:
+            if entry.extra_meta is None:
+                entry.extra_meta = {}
+            entry.extra_meta[key] = value
+
+
 class BasePlaylistEntry:
+    __slots__ = ('filename', '_is_downloading', '_waiting_futures', 'fair_tag')
+
     def __init__(self):
         self.filename = None
         self._is_downloading = False
-        self._waiting_futures = []
+        self._waiting_futures = None
+
+        # The virtual finish time the fair queue modes order entries by, see `Playlist.set_mode`.
+        self.fair_tag = 0
 
     @property
     def is_downloaded(self):
@@ -42,6 +132,8 @@ class BasePlaylistEntry:
         else:
             # If we request a ready future, let's ensure that it'll actually resolve at one point.
             asyncio.ensure_future(self._download())
+            if self._waiting_futures is None:
+                self._waiting_futures = []
             self._waiting_futures.append(future)
 
         return future
@@ -50,8 +142,8 @@ class BasePlaylistEntry:
         """
             Calls `cb` for each future that is not cancelled. Absorbs and logs any errors that may have occurred.
         """
-        futures = self._waiting_futures
-        self._waiting_futures = []
+        futures = self._waiting_futures or []
+        self._waiting_futures = None
 
         for future in futures:
             if future.cancelled():
@@ -70,41 +162,168 @@ class BasePlaylistEntry:
         return id(self)
 
 class URLPlaylistEntry(BasePlaylistEntry):
-    def __init__(self, playlist, url, title, duration=0, expected_filename=None, **meta):
+    """
+        A song in a queue.  What it plays is a shared `Track`, who queued it where is kept as ids (`meta` looks them
+        up), so a queued entry takes little more memory than its slots.
+    """
+    __slots__ = (
+        'playlist', 'track', 'author_id', 'channel_id', 'seek', 'quiet', 'extra_meta',
+        'needs_validation', '_json', 'stream_url', 'stream_headers'
+    )
+
+    # noinspection PyShadowingBuiltins
+    def __init__(self, playlist, url, title, duration=0, expected_filename=None, extractor=None, id=None,
+                 author=None, channel=None, author_id=None, channel_id=None, seek=None, quiet=None, **meta):
         super().__init__()
 
         self.playlist = playlist
-        self.url = url
-        self.title = title
-        self.duration = duration
-        self.expected_filename = expected_filename
-        self.meta = meta
+        self.track = Track.get(url, title, duration, expected_filename, extractor, id)
+
+        self.author_id = author.id if author else author_id
+        self.channel_id = channel.id if channel else channel_id
+        self.seek = seek
+        self.quiet = quiet
+        self.extra_meta = meta or None
+
+        # Entries restored from a saved queue are looked up again right before they're downloaded.
+        self.needs_validation = False
 
-        self.download_folder = self.playlist.downloader.download_folder
+        # The last `to_json` result and the seek position it was made with.
+        self._json = None
+
+        # Set by `prepare_stream` when the entry can be played before it's downloaded.
+        self.stream_url = None
+        self.stream_headers = None
+
+    url = property(lambda self: self.track.url)
+    title = property(lambda self: self.track.title)
+    duration = property(lambda self: self.track.duration)
+    expected_filename = property(lambda self: self.track.expected_filename)
+    extractor = property(lambda self: self.track.extractor)
+    id = property(lambda self: self.track.id)
+
+    @property
+    def meta(self):
+        return EntryMeta(self)
+
+    @property
+    def channel(self):
+        if self.channel_id is not None:
+            return self.playlist.bot.get_channel(self.channel_id)
+
+    @property
+    def author(self):
+        channel = self.channel
+        if channel is not None and self.author_id is not None:
+            return channel.server.get_member(self.author_id)
+
+    @property
+    def download_folder(self):
+        return self.playlist.downloader.download_folder
 
     def to_json(self):
-        author = self.meta.get("author", None)
-        channel = self.meta.get("channel", None)
+        seek = self.seek or 0
+        if self._json is None or self._json[0] != seek:
+            self._json = (seek, self._dump_json())
 
-        if author and channel:
-            authorid = author.id
-            channelid = channel.id
+        return self._json[1]
+
+    def _dump_json(self):
+        if self.author_id and self.channel_id:
+            authorid = self.author_id
+            channelid = self.channel_id
         else:
             authorid = None
             channelid = None
 
         return json.dumps({
+            "version": 2,
             "url": self.url,
+            "title": self.title,
+            "duration": self.duration,
+            "extractor": self.extractor,
+            "id": self.id,
+            "expected_filename": self.expected_filename,
             "meta": {
                 "author": authorid,
                 "channel": channelid,
-                "seek": self.meta.get("seek", 0)
+                "seek": self.seek or 0
             }
         })
 
+    def _find_by_id(self, audio_cache, touch=True):
+        """
+            Finds the song's file by the `extractor-id-` start of its name, which still matches when the title changed.
+        """
+        if self.extractor and self.id and self.extractor != 'generic':
+            prefix = self.playlist.downloader.filename_prefix(self.extractor, self.id)
+            return audio_cache.find_prefix(prefix, canonicalize(self.url), touch=touch)
+
+    async def revalidate(self):
+        """
+            Looks the song up again, refreshing the info stored with it.  Raises ExtractionError if it's gone.
+        """
+        try:
+            info = await self.playlist.downloader.extract_info(self.playlist.loop, self.url, download=False)
+        except Exception as e:
+            raise ExtractionError('Could not extract information from {}\n\n{}'.format(self.url, e))
+
+        if not info or info.get('_type', None) == 'playlist':
+            raise ExtractionError('Could not extract information from %s' % self.url)
+
+        track = Track.get(
+            self.url,
+            info.get('title', 'Untitled'),
+            info.get('duration', 0) or 0,
+            self.playlist.downloader.prepare_filename(info),
+            info.get('extractor', None),
+            info.get('id', None)
+        )
+        self.needs_validation = False
+
+        if track is not self.track:
+            self.track = track
+            self._json = None
+            self.playlist.update_entry(self)
+
+    async def prepare_stream(self):
+        """
+            Looks up a direct media url for this entry so that playback can start while it's still downloading.
+            Returns False when the song can't be streamed, in which case the download has to be waited on.
+
+            Songs that still need looking up are revalidated first, so one that turns out gone or too long isn't
+            played.  The download does the same lookup and reports the error.
+        """
+        if self.needs_validation:
+            try:
+                await self.revalidate()
+            except ExtractionError as e:
+                log.info("Can't stream %s: %s", self.url, e)
+                return False
+
+        try:
+            info = await self.playlist.downloader.extract_info(
+                self.playlist.loop, self.url, download=False, process=True, cache=False)
+        except Exception as e:
+            log.info("Can't stream %s: %s", self.url, e)
+            return False
+
+        if not info or info.get('_type', None) == 'playlist' or not info.get('url', None):
+            return False
+
+        # ffmpeg can't read fragmented formats (dash, hls) from a single url.
+        if info.get('protocol', 'https') not in ('http', 'https') or not info['url'].startswith(('http:', 'https:')):
+            return False
+
+        self.stream_url = info['url']
+        self.stream_headers = info.get('http_headers', None) or {}
+        return True
+
     # noinspection PyTypeChecker
     async def _download(self):
         if self._is_downloading:
+            # Someone is waiting on us now, the download might have become more urgent.
+            self.playlist.downloader.scheduler.update(self, self.playlist.deadline_for(self))
             return
 
         self._is_downloading = True
@@ -113,61 +332,68 @@ class URLPlaylistEntry(BasePlaylistEntry):
             if not os.path.exists(self.download_folder):
                 os.makedirs(self.download_folder)
 
+            audio_cache = self.playlist.downloader.audio_cache
+            await audio_cache.wait_ready()
+
+            # A restored song whose file is still around doesn't need looking up.
+            if self.needs_validation and (not self.expected_filename or not self._find_by_id(audio_cache, touch=False)):
+                await self.revalidate()
+
             # self.expected_filename: audio_cache\youtube-9R8aSKwTEMg-NOMA_-_Brain_Power.m4a
             extractor = os.path.basename(self.expected_filename).split('-')[0]
 
             # the generic extractor requires special handling
             if extractor == 'generic':
                 log.debug("Handling generic")
-                flistdir = [f.rsplit('-', 1)[0] for f in os.listdir(self.download_folder)]
                 expected_fname_noex, fname_ex = os.path.basename(self.expected_filename).rsplit('.', 1)
+                lfile = audio_cache.find_generic(expected_fname_noex, canonicalize(self.url))
 
-                if expected_fname_noex in flistdir:
+                if lfile:
                     try:
                         rsize = int(await get_header(self.playlist.bot.aiosession, self.url, 'CONTENT-LENGTH'))
                     except:
                         rsize = 0
 
-                    lfile = os.path.join(
-                        self.download_folder,
-                        os.listdir(self.download_folder)[flistdir.index(expected_fname_noex)]
-                    )
-
                     log.debug("Resolved %s to %s" % (self.expected_filename, lfile))
                     lsize = os.path.getsize(lfile)
                     log.debug("Remote size: %s Local size: %s" % (rsize, lsize))
 
                     if lsize != rsize:
-                        await self._really_download(hash=True)
+                        await self._schedule_download(hash=True)
                     else:
                         self.filename = lfile
 
                 else:
-                    await self._really_download(hash=True)
+                    await self._schedule_download(hash=True)
 
             else:
-                ldir = os.listdir(self.download_folder)
-                flistdir = [f.rsplit('.', 1)[0] for f in ldir]
                 expected_fname_base = os.path.basename(self.expected_filename)
                 expected_fname_noex = expected_fname_base.rsplit('.', 1)[0]
 
                 # idk wtf this is but its probably legacy code
                 # or i have youtube to blame for changing shit again
 
-                if expected_fname_base in ldir:
-                    self.filename = os.path.join(self.download_folder, expected_fname_base)
+                lfile = audio_cache.find(expected_fname_base, canonicalize(self.url))
+                lfile_noex = None if lfile else audio_cache.find_stem(expected_fname_noex, canonicalize(self.url))
+
+                # The title is part of the name, so a renamed video is only found by its id.
+                if not lfile and not lfile_noex:
+                    lfile = self._find_by_id(audio_cache)
+
+                if lfile:
+                    self.filename = lfile
                     log.info("Cached: %s", self.url)
 
-                elif expected_fname_noex in flistdir:
+                elif lfile_noex:
                     log.info("Cached (different extension): %s", self.url)
-                    self.filename = os.path.join(self.download_folder, ldir[flistdir.index(expected_fname_noex)])
+                    self.filename = lfile_noex
                     log.info("Expected %s, got %s" % (
                         self.expected_filename.rsplit('.', 1)[-1],
                         self.filename.rsplit('.', 1)[-1]
                     ))
 
                 else:
-                    await self._really_download()
+                    await self._schedule_download()
 
             # Trigger ready callbacks.
             self._for_each_future(lambda future: future.set_result(self))
@@ -179,30 +405,54 @@ class URLPlaylistEntry(BasePlaylistEntry):
         finally:
             self._is_downloading = False
 
+    # noinspection PyShadowingBuiltins
+    async def _schedule_download(self, *, hash=False):
+        """
+            Queues the actual download with the download scheduler, which runs whichever song has to play soonest first.
+        """
+        await self.playlist.downloader.scheduler.run(
+            self,
+            lambda: self._really_download(hash=hash),
+            self.playlist.deadline_for(self)
+        )
+
     # noinspection PyShadowingBuiltins
     async def _really_download(self, *, hash=False):
         log.info("Started: %s", self.url)
+        self.filename = await self.playlist.downloader.download(self.playlist.loop, self.url, hash=hash)
+        log.info("Completed: %s", self.url)
 
-        try:
-            result = await self.playlist.downloader.extract_info(self.playlist.loop, self.url, download=True)
-        except Exception as e:
-            raise ExtractionError(e)
 
-        log.info("Completed: %s", self.url)
+class LazyPlaylistEntry(URLPlaylistEntry):
+    """
+        A playlist song that is only known from the playlist's listing, without being looked up.  It's looked up right
+        before it's downloaded, once it's next in line, so the songs of a long playlist that never get played are
+        never looked up.  `Playlist.get_next_entry` drops it from the queue if that fails.
 
-        if result is None:
-            raise ExtractionError("ytdl broke and hell if I know why")
-            # What the fuck do I do now?
+        Until then the title, duration and id are whatever the listing had, the title falls back to the url.
+    """
+    __slots__ = ('max_duration', '_error')
 
-        self.filename = unhashed_fname = self.playlist.downloader.ytdl.prepare_filename(result)
+    # noinspection PyShadowingBuiltins
+    def __init__(self, playlist, url, title=None, duration=0, extractor=None, id=None, max_duration=0, **meta):
+        super().__init__(playlist, url, title or url, duration, extractor=extractor, id=id, **meta)
 
-        if hash:
-            # insert the 8 last characters of the file hash to the file name to ensure uniqueness
-            self.filename = md5sum(unhashed_fname, 8).join('-.').join(unhashed_fname.rsplit('.', 1))
+        self.needs_validation = True
+        self.max_duration = max_duration
 
-            if os.path.isfile(self.filename):
-                # Oh bother it was actually there.
-                os.unlink(unhashed_fname)
-            else:
-                # Move the temporary file to it's final location.
-                os.rename(unhashed_fname, self.filename)
+        # Why the lookup failed, a failed song isn't looked up twice.
+        self._error = None
+
+    async def revalidate(self):
+        if self._error:
+            raise self._error
+
+        try:
+            await super().revalidate()
+
+            if self.max_duration and self.duration > self.max_duration:
+                raise ExtractionError("Song duration exceeds limit (%s > %s)" % (self.duration, self.max_duration))
+        except ExtractionError as e:
+            self._error = e
+            self.needs_validation = True
+            raise
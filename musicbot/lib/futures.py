@@ -0,0 +1,15 @@
+import asyncio
+
+
+def _retrieve_exception(future):
+    if not future.cancelled():
+        future.exception()
+
+
+def share(future):
+    """
+        Returns `future` shielded for one of the callers waiting on it: a caller giving up doesn't cancel it for
+        everyone else.  Its exception counts as retrieved, nobody may be waiting on it anymore by the time it fails.
+    """
+    future.add_done_callback(_retrieve_exception)
+    return asyncio.shield(future)
@@ -0,0 +1,345 @@
+import random
+from collections import Counter
+
+
+class _Node:
+    __slots__ = ('entry', 'duration', 'author', 'priority', 'left', 'right', 'parent', 'size', 'total')
+
+    def __init__(self, entry, duration, author):
+        self.entry = entry
+        self.duration = duration
+        self.author = author
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.parent = None
+        self.size = 1
+        self.total = duration
+
+    def update(self):
+        self.size = 1
+        self.total = self.duration
+
+        if self.left:
+            self.size += self.left.size
+            self.total += self.left.total
+
+        if self.right:
+            self.size += self.right.size
+            self.total += self.right.total
+
+
+def _duration(entry):
+    return entry.duration or 0
+
+
+def _author(entry):
+    return entry.author_id
+
+
+class IndexedQueue:
+    """
+        The queue of a playlist.  Behaves like the `deque` it replaces, but also knows where each entry is, how long
+        the songs before any position take to play and how many songs each user (by id) has queued.
+
+        It's a treap ordered by position: every node keeps the number of entries and the total duration of its
+        subtree, and each entry maps to its node.  Adding, removing and finding the position of an entry, indexing
+        and `duration_until` take O(log n) time; `count_for` is O(1).  Call `update` when the duration of a queued
+        entry changes.
+
+        `version` changes with every change of the queue, for caching things made from it.
+    """
+
+    def __init__(self, entries=()):
+        self.version = 0
+        self._root = None
+        self._nodes = {}
+        self._authors = Counter()
+        self.extend(entries)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __bool__(self):
+        return bool(self._nodes)
+
+    def __contains__(self, entry):
+        return entry in self._nodes
+
+    def __iter__(self):
+        # Iterative in order walk, the tree can be deeper than the recursion limit is comfortable with.
+        stack = []
+        node = self._root
+
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+
+            node = stack.pop()
+            yield node.entry
+            node = node.right
+
+    def iter_from(self, index):
+        """
+            Iterates over the entries from position `index` on, finding the first one takes O(log n).
+        """
+        stack = []
+        node = self._root
+
+        while node:
+            left = node.left.size if node.left else 0
+
+            if index < left:
+                stack.append(node)
+                node = node.left
+            elif index == left:
+                stack.append(node)
+                break
+            else:
+                index -= left + 1
+                node = node.right
+
+        while stack:
+            node = stack.pop()
+            yield node.entry
+
+            node = node.right
+            while node:
+                stack.append(node)
+                node = node.left
+
+    def __getitem__(self, index):
+        return self._node_at(self._index(index)).entry
+
+    def _index(self, index):
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError("queue index out of range")
+
+        return index
+
+    def _node_at(self, index):
+        node = self._root
+
+        while True:
+            left = node.left.size if node.left else 0
+
+            if index < left:
+                node = node.left
+            elif index == left:
+                return node
+            else:
+                index -= left + 1
+                node = node.right
+
+    def index(self, entry):
+        """
+            Returns the (0 based) position of `entry`, raises ValueError if it isn't queued.
+        """
+        node = self._nodes.get(entry, None)
+        if node is None:
+            raise ValueError("entry is not in the queue")
+
+        position = node.left.size if node.left else 0
+        while node.parent:
+            if node is node.parent.right:
+                position += (node.parent.left.size if node.parent.left else 0) + 1
+            node = node.parent
+
+        return position
+
+    def duration_until(self, position):
+        """
+            Returns the total duration of the first `position` entries.
+        """
+        total = 0
+        node = self._root
+
+        while node and position > 0:
+            left = node.left.size if node.left else 0
+
+            if position <= left:
+                node = node.left
+                continue
+
+            total += (node.left.total if node.left else 0) + node.duration
+            position -= left + 1
+            node = node.right
+
+        return total
+
+    def bisect(self, value, key):
+        """
+            Returns how many entries have a `key(entry)` of at most `value`, for a queue that is sorted by `key`.
+        """
+        position = 0
+        node = self._root
+
+        while node:
+            if key(node.entry) <= value:
+                position += (node.left.size if node.left else 0) + 1
+                node = node.right
+            else:
+                node = node.left
+
+        return position
+
+    @property
+    def total_duration(self):
+        return self._root.total if self._root else 0
+
+    def count_for(self, author):
+        return self._authors[author]
+
+    def insert(self, position, entry):
+        """
+            Puts `entry` at `position`, like `list.insert`.
+        """
+        if entry in self._nodes:
+            raise ValueError("entry is already queued")
+
+        position = max(0, min(len(self), position + len(self) if position < 0 else position))
+
+        node = _Node(entry, _duration(entry), _author(entry))
+        self._nodes[entry] = node
+        self.version += 1
+        self._authors[node.author] += 1
+
+        if self._root is None:
+            self._root = node
+            return
+
+        # Walk down to the leaf slot at `position`...
+        parent = self._root
+        while True:
+            left = parent.left.size if parent.left else 0
+
+            if position <= left:
+                if parent.left is None:
+                    parent.left = node
+                    break
+                parent = parent.left
+            else:
+                position -= left + 1
+                if parent.right is None:
+                    parent.right = node
+                    break
+                parent = parent.right
+
+        node.parent = parent
+        self._refresh(parent)
+
+        # ...and rotate the new node up until the heap order of the priorities holds again.
+        while node.parent and node.priority > node.parent.priority:
+            self._rotate_up(node)
+
+    def append(self, entry):
+        self.insert(len(self), entry)
+
+    def appendleft(self, entry):
+        self.insert(0, entry)
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def remove(self, entry):
+        """
+            Removes `entry`, raises ValueError if it isn't queued.
+        """
+        node = self._nodes.pop(entry, None)
+        if node is None:
+            raise ValueError("entry is not in the queue")
+
+        self.version += 1
+        self._authors[node.author] -= 1
+        if not self._authors[node.author]:
+            del self._authors[node.author]
+
+        # Rotate the node down until it's a leaf, then cut it off.
+        while node.left or node.right:
+            if node.right is None or (node.left and node.left.priority > node.right.priority):
+                self._rotate_up(node.left)
+            else:
+                self._rotate_up(node.right)
+
+        parent = node.parent
+        if parent is None:
+            self._root = None
+            return
+
+        if parent.left is node:
+            parent.left = None
+        else:
+            parent.right = None
+
+        node.parent = None
+        self._refresh(parent)
+
+    def popleft(self):
+        if not self._root:
+            raise IndexError("pop from an empty queue")
+
+        entry = self._node_at(0).entry
+        self.remove(entry)
+        return entry
+
+    def clear(self):
+        self.version += 1
+        self._root = None
+        self._nodes.clear()
+        self._authors.clear()
+
+    def update(self, entry):
+        """
+            Picks up a changed duration (or anything else shown about it) of `entry`.  Does nothing if it isn't queued.
+        """
+        node = self._nodes.get(entry, None)
+        if node is None:
+            return
+
+        self.version += 1
+        node.duration = _duration(entry)
+        self._refresh(node)
+
+    def shuffle(self):
+        entries = list(self)
+        random.shuffle(entries)
+        self.clear()
+        self.extend(entries)
+
+    def _refresh(self, node):
+        while node:
+            node.update()
+            node = node.parent
+
+    def _rotate_up(self, node):
+        parent = node.parent
+        grandparent = parent.parent
+
+        if parent.left is node:
+            parent.left = node.right
+            if node.right:
+                node.right.parent = parent
+            node.right = parent
+        else:
+            parent.right = node.left
+            if node.left:
+                node.left.parent = parent
+            node.left = parent
+
+        parent.parent = node
+        node.parent = grandparent
+
+        if grandparent is None:
+            self._root = node
+        elif grandparent.left is parent:
+            grandparent.left = node
+        else:
+            grandparent.right = node
+
+        parent.update()
+        node.update()
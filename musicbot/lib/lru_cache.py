@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Stored in place of a value when a lookup is known to have failed.
+MISSING = object()
+
+
+class LRUCache:
+    """
+        A thread safe LRU cache bounded by both the number of entries and the total size of the values.
+
+        Every item expires after `ttl` seconds.  Negative results (lookups that produced nothing or failed) can be
+        stored with `set_negative` and expire after the shorter `negative_ttl`.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=60 * 60, negative_ttl=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def get(self, key):
+        """
+            Returns the cached value, a negative result (see `is_negative`) or None if the key is not cached.
+        """
+        with self._lock:
+            item = self._items.get(key, None)
+
+            if item is not None:
+                value, size, expires = item
+
+                if expires > time.monotonic():
+                    self._items.move_to_end(key)
+
+                    if is_negative(value):
+                        self.negative_hits += 1
+                    else:
+                        self.hits += 1
+
+                    return value
+
+                self._remove(key)
+
+            self.misses += 1
+
+    def set(self, key, value, size=1, ttl=None):
+        # Don't let a single item wipe out the entire cache.
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+
+            self._items[key] = (value, size, time.monotonic() + (ttl or self.ttl))
+            self._bytes += size
+
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._items)))
+                self.evictions += 1
+
+    def set_negative(self, key, reason=None):
+        self.set(key, MISSING if reason is None else _NegativeResult(reason), ttl=self.negative_ttl)
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._items),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def _remove(self, key):
+        value, size, expires = self._items.pop(key)
+        self._bytes -= size
+
+
+class _NegativeResult:
+    """
+        A cached failure.  Holds on to the exception so that it can be raised again for the next caller.
+    """
+    __slots__ = ("exception",)
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def is_negative(value):
+    return value is MISSING or isinstance(value, _NegativeResult)
@@ -0,0 +1,118 @@
+import heapq
+import itertools
+import traceback
+
+import asyncio
+from musicbot.lib.futures import share
+
+
+class _Job:
+    __slots__ = ("key", "factory", "deadline", "future", "started")
+
+    def __init__(self, key, factory, deadline, future):
+        self.key = key
+        self.factory = factory
+        self.deadline = deadline
+        self.future = future
+        self.started = False
+
+
+class DeadlineScheduler:
+    """
+        Runs coroutine jobs earliest-deadline-first, with at most `max_concurrent` of them running at once.
+
+        Deadlines are in event loop time (`loop.time()`).  A job that finishes after its deadline counts as a deadline
+        miss.  Jobs without a deadline (`float('inf')`) only run when nothing more urgent is waiting.
+    """
+
+    def __init__(self, max_concurrent=2):
+        self.max_concurrent = max_concurrent
+        self.loop = asyncio.get_event_loop()
+
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.deadline_misses = 0
+
+        self._heap = []
+        self._jobs = {}
+        self._counter = itertools.count()
+
+    @property
+    def queue_depth(self):
+        return len(self._jobs) - self.running
+
+    def run(self, key, factory, deadline=float('inf')):
+        """
+            Queues `factory()` to be run and returns a future with its result.  If a job with the same key is already
+            queued or running, its future is returned instead and its deadline moved up if `deadline` is earlier.
+        """
+        job = self._jobs.get(key, None)
+
+        if job is None:
+            job = _Job(key, factory, deadline, self.loop.create_future())
+            self._jobs[key] = job
+            heapq.heappush(self._heap, (deadline, next(self._counter), job))
+            self._pump()
+
+        else:
+            self.update(key, deadline)
+
+        return share(job.future)
+
+    def update(self, key, deadline):
+        """
+            Moves the deadline of a queued job up.  Does nothing if the job has already started.
+        """
+        job = self._jobs.get(key, None)
+
+        if job and not job.started and deadline < job.deadline:
+            job.deadline = deadline
+
+            # The old heap item is left behind and skipped once it's popped.
+            heapq.heappush(self._heap, (deadline, next(self._counter), job))
+
+    def _pump(self):
+        while self.running < self.max_concurrent and self._heap:
+            deadline, _, job = heapq.heappop(self._heap)
+
+            if job.started or deadline != job.deadline:
+                continue
+
+            job.started = True
+            self.running += 1
+
+            task = asyncio.ensure_future(job.factory(), loop=self.loop)
+            task.add_done_callback(lambda task, job=job: self._done(job, task))
+
+    def _done(self, job, task):
+        self.running -= 1
+        self.completed += 1
+        del self._jobs[job.key]
+
+        if self.loop.time() > job.deadline:
+            self.deadline_misses += 1
+
+        try:
+            if task.cancelled():
+                job.future.cancel()
+
+            elif task.exception():
+                self.failed += 1
+                job.future.set_exception(task.exception())
+
+            else:
+                job.future.set_result(task.result())
+        except:
+            traceback.print_exc()
+
+        self._pump()
+
+    def stats(self):
+        return {
+            "queued": self.queue_depth,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "deadline_misses": self.deadline_misses
+        }
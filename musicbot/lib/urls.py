@@ -0,0 +1,100 @@
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track where a link was shared from.
+tracking_params = re.compile(r'^(utm_\w+|fbclid|gclid|igshid)$')
+
+# Rules for specific sites, filled in with the `rule` decorator.
+_rules = []
+
+
+def rule(*hosts):
+    """
+        Registers a function that canonicalizes urls for the given hosts.  A host starting with a dot matches all of
+        its subdomains.
+
+        The function is called with the result of `urlsplit` and returns the canonical url, or None to fall back to
+        the generic handling.
+    """
+    def decorate(f):
+        _rules.append((hosts, f))
+        return f
+
+    return decorate
+
+
+def _find_rule(host):
+    for hosts, f in _rules:
+        for pattern in hosts:
+            if host == pattern or (pattern.startswith('.') and host.endswith(pattern)):
+                return f
+
+
+def canonicalize(url):
+    """
+        Returns a canonical form of `url` so that different links to the same song share cache entries and play
+        counts.  Anything that isn't a http(s) url, like a search query, is returned stripped but otherwise as is.
+    """
+    url = url.strip().strip('<>')
+
+    # People paste links without the scheme all the time.
+    if not re.match(r'^https?://', url, re.I):
+        host = url.split('/', 1)[0].lower()
+
+        if ' ' in url or not _find_rule(host):
+            return url
+
+        url = 'https://' + url
+
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+        port = parts.port
+    except ValueError:
+        return url
+
+    f = _find_rule(host)
+    if f:
+        canonical = f(parts._replace(netloc=host))
+        if canonical:
+            return canonical
+
+    if port and port != {'http': 80, 'https': 443}.get(parts.scheme.lower(), None):
+        host += ':%s' % port
+
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not tracking_params.match(k)]
+
+    return urlunsplit((parts.scheme.lower(), host, parts.path or '/', urlencode(query), ''))
+
+
+@rule('youtube.com', '.youtube.com', 'youtu.be', 'youtube-nocookie.com', '.youtube-nocookie.com')
+def _youtube(parts):
+    query = dict(parse_qsl(parts.query))
+    path = parts.path.rstrip('/')
+
+    if parts.netloc == 'youtu.be':
+        video_id = path.lstrip('/')
+
+    elif path == '/watch':
+        video_id = query.get('v', None)
+
+    elif path == '/playlist' and 'list' in query:
+        return 'https://www.youtube.com/playlist?' + urlencode({'list': query['list']})
+
+    else:
+        match = re.match(r'^/(?:embed|v|shorts)/([\w-]+)$', path)
+        video_id = match and match.group(1)
+
+    if video_id and re.match(r'^[\w-]+$', video_id):
+        return 'https://www.youtube.com/watch?' + urlencode({'v': video_id})
+
+
+@rule('soundcloud.com', '.soundcloud.com')
+def _soundcloud(parts):
+    if parts.netloc in ('soundcloud.com', 'www.soundcloud.com', 'm.soundcloud.com'):
+        return 'https://soundcloud.com' + parts.path.rstrip('/')
+
+
+@rule('.bandcamp.com')
+def _bandcamp(parts):
+    return 'https://%s%s' % (parts.netloc, parts.path.rstrip('/'))
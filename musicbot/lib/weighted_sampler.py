@@ -0,0 +1,131 @@
+import random
+
+
+class WeightedSampler:
+    """
+        Picks keys at random, weighted by a count per key, and keeps up as the counts grow.  Like `weighted_choice`,
+        counts over `diminish` only weigh half as much.
+
+        The weights are kept in a Fenwick tree, so picking a key and changing a count both take O(log n).  The weights
+        are doubled to keep the halved ones whole numbers.
+
+        `start_loading` and `finish_loading` fill the sampler from a full set of counts, `build` does the expensive part
+        and doesn't touch the sampler, so it can run in another thread.  Counts added while it runs are applied after.
+    """
+
+    def __init__(self, diminish=None):
+        self.diminish = diminish
+        self.loaded = False
+
+        self._keys = []
+        self._index = {}
+        self._counts = []
+        self._tree = [0]
+        self._pending = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def total(self):
+        return self._prefix(len(self._keys))
+
+    def _weight(self, count):
+        if self.diminish and count > self.diminish:
+            return count
+
+        return count * 2
+
+    @classmethod
+    def build(cls, counts, diminish=None):
+        """
+            Builds the contents of a sampler for `counts`, a dict of key: count (counts can be strings), in O(n).
+        """
+        sampler = cls(diminish)
+
+        keys = list(counts)
+        values = [int(counts[key]) for key in keys]
+        tree = [0] + [sampler._weight(count) for count in values]
+
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+
+        return keys, values, tree
+
+    def start_loading(self):
+        self._pending = {}
+
+    def finish_loading(self, built):
+        self._keys, self._counts, self._tree = built
+        self._index = {key: i for i, key in enumerate(self._keys)}
+        self.loaded = True
+
+        pending, self._pending = self._pending or {}, None
+        for key, count in pending.items():
+            self.add(key, count)
+
+    def add(self, key, count=1):
+        """
+            Adds `count` to the count of `key`.
+        """
+        if not self.loaded:
+            if self._pending is not None:
+                self._pending[key] = self._pending.get(key, 0) + count
+            return
+
+        i = self._index.get(key, None)
+        if i is None:
+            self._append(key, count)
+            return
+
+        old = self._counts[i]
+        self._counts[i] = old + count
+        self._update(i + 1, self._weight(old + count) - self._weight(old))
+
+    def _append(self, key, count):
+        i = len(self._keys) + 1
+        weight = self._weight(count)
+
+        self._index[key] = i - 1
+        self._keys.append(key)
+        self._counts.append(count)
+
+        # A new node covers itself and the (i - lowbit(i), i - 1] range before it.
+        self._tree.append(weight + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+
+    def _update(self, i, delta):
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, i):
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+
+        return total
+
+    def choice(self):
+        """
+            Returns a random key, or None if there are none.
+        """
+        total = self.total
+        if not total:
+            return None
+
+        target = random.randrange(total)
+
+        # Walk down the tree to the first key whose running total passes `target`.
+        position = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = position + step
+            if nxt < len(self._tree) and self._tree[nxt] <= target:
+                position = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+
+        return self._keys[position]
@@ -21,6 +21,8 @@ class PermissionsDefaults:
     AllowPlaylists = True
     InstaSkip = False
 
+    QueueWeight = 1
+
 
 class Permissions:
     def __init__(self, config_file, grant_all=None):
@@ -91,6 +93,8 @@ class PermissionGroup:
         self.allow_playlists = section_data.get('AllowPlaylists', fallback=PermissionsDefaults.AllowPlaylists)
         self.instaskip = section_data.get('InstaSkip', fallback=PermissionsDefaults.InstaSkip)
 
+        self.queue_weight = section_data.get('QueueWeight', fallback=PermissionsDefaults.QueueWeight)
+
         self.validate()
 
     def validate(self):
@@ -132,6 +136,13 @@ class PermissionGroup:
             self.instaskip, PermissionsDefaults.InstaSkip
         )
 
+        try:
+            self.queue_weight = float(self.queue_weight)
+            if self.queue_weight <= 0:
+                raise ValueError
+        except:
+            self.queue_weight = PermissionsDefaults.QueueWeight
+
     def __repr__(self):
         return "<PermissionGroup: %s>" % self.name
 
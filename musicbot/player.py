@@ -1,6 +1,7 @@
 import audioop
 import logging
 import os
+import shlex
 import subprocess
 import sys
 import traceback
@@ -73,7 +74,7 @@ class MusicPlayer(EventEmitter):
         self.loop = bot.loop
         self.voice_client = voice_client
         self.playlist = playlist
-        self.playlist.on('entry-added', self.on_entry_added)
+        self.playlist.on('entries-added', self.on_entries_added)
         self.state = MusicPlayerState.STOPPED
 
         self._volume = bot.config.default_volume
@@ -94,7 +95,7 @@ class MusicPlayer(EventEmitter):
         if self._current_player:
             self._current_player.buff.volume = value
 
-    def on_entry_added(self, playlist, entry):
+    def on_entries_added(self, playlist, entries):
         if self.is_stopped:
             self.loop.call_later(2, self.play)
 
@@ -114,7 +115,7 @@ class MusicPlayer(EventEmitter):
             entry.meta["seek"] = time
             entry.meta["quiet"] = True
             self.playlist.entries.appendleft(entry)
-            self.bot.redis.lpush("musicbot:queue:" + self.voice_client.server.id, entry.to_json())
+            self.playlist.persist('lpush', entry.to_json())
             self._kill_current_player()
 
     def skip(self):
@@ -213,7 +214,7 @@ class MusicPlayer(EventEmitter):
         with await self._play_lock:
             if self.is_stopped or _continue:
                 try:
-                    entry = await self.playlist.get_next_entry()
+                    entry = await self.playlist.get_next_entry(stream=self.bot.config.progressive_playback)
                 except Exception as e:
                     print("Failed to get entry.")
                     traceback.print_exc()
@@ -235,8 +236,19 @@ class MusicPlayer(EventEmitter):
                     seek=entry.meta.get("seek", 0)
                 )
 
+                if entry.filename:
+                    source = entry.filename
+                else:
+                    # Still downloading, play straight from the source.
+                    source = entry.stream_url
+                    before_options += " -reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+
+                    if entry.stream_headers:
+                        before_options += " -headers " + shlex.quote(
+                            "".join("%s: %s\r\n" % header for header in entry.stream_headers.items()))
+
                 self._current_player = self._monkeypatch_player(self.voice_client.create_ffmpeg_player(
-                    entry.filename,
+                    source,
                     before_options=before_options,
                     options="-vn -b:a 128k",
                     stderr=subprocess.PIPE,
@@ -3,20 +3,25 @@ import json
 import logging
 import random
 import traceback
-from collections import deque
+from collections import Counter, deque
 from itertools import islice
 
 import asyncio
-import redis
 from musicbot.commands.music import cmd_play
-from musicbot.connections import redis_pool
-from musicbot.entry import URLPlaylistEntry
+from musicbot.constants import QUEUE_MODES, QUEUE_PAGE_SIZE, QUEUE_TITLE_LIMIT
+from musicbot.entry import LazyPlaylistEntry, URLPlaylistEntry
 from musicbot.exceptions import ExtractionError, RetryPlay, WrongEntryTypeError
 from musicbot.lib.event_emitter import EventEmitter
+from musicbot.lib.indexed_queue import IndexedQueue
+from musicbot.lib.urls import canonicalize
+from musicbot.structures import ImportProgress
 from musicbot.utils import get_header
 
 log = logging.getLogger(__name__)
 
+# Stands in for a saved entry while it's being replaced or removed by position, it's never left in the list.
+GAP = "musicbot:gap"
+
 
 class Playlist(EventEmitter):
     """
@@ -27,18 +32,44 @@ class Playlist(EventEmitter):
         super().__init__()
         self.bot = bot
         self.serverid = serverid
-        self.redis = redis.StrictRedis(connection_pool=redis_pool)
+        self.storage = bot.storage
         self.loop = bot.loop
         self.downloader = bot.downloader
-        self.entries = deque()
+        self.entries = IndexedQueue()
+        self.queue_key = "musicbot:queue:" + serverid
+        self.mode_key = "musicbot:queuemode:" + serverid
+        self.mode = 'fifo'
+
+        # The fair queue modes' virtual time (the tag of the last song played) and the tag of each author's last song.
+        self._virtual_time = 0
+        self._finish = {}
 
-        self.load_saved()
+        # Rendered pages of the queue listing and the version of the queue they were rendered from.
+        self._pages = {}
+        self._pages_version = None
+
+        bot.write_behind.mirror(self.queue_key, lambda: [entry.to_json() for entry in self.entries])
 
     def __iter__(self):
         return iter(self.entries)
 
-    def load_saved(self):
-        items = self.redis.lrange("musicbot:queue:" + self.serverid, 0, -1)
+    def persist(self, command, *values):
+        """
+            Mirrors a change of the queue to its saved copy in redis, see `WriteBehind`.
+        """
+        self.bot.write_behind.write(command, self.queue_key, *values)
+
+    async def load_saved(self):
+        """
+            Restores the saved queue, in order and without looking anything up.  The songs are looked up again right
+            before they're downloaded (see `URLPlaylistEntry.revalidate`).
+
+            Records saved by older versions only have the url, their title shows as the url until then.  Songs that
+            were never looked up come back as `LazyPlaylistEntry`s.
+        """
+        self.mode = await self.storage.get(self.mode_key) or 'fifo'
+        items = await self.storage.lrange(self.queue_key, 0, -1)
+        restored = []
 
         for item in items:
             meta = {}
@@ -48,6 +79,7 @@ class Playlist(EventEmitter):
             except json.JSONDecodeError as e:
                 log.error(e)
                 log.error(item)
+                self.persist('lrem', 1, item)
                 continue
 
             # Fix for the to_dict() returning json derp.
@@ -57,39 +89,175 @@ class Playlist(EventEmitter):
                 except json.JSONDecodeError as e:
                     log.error(e)
                     log.error(data)
+                    self.persist('lrem', 1, item)
                     continue
 
-            # Sanity check
-            if "url" not in data:
+            # Sanity check, whatever isn't restored mustn't stay in the saved list either or positions stop matching.
+            if not isinstance(data, dict) or "url" not in data:
+                self.persist('lrem', 1, item)
                 continue
 
             if "channel" in data["meta"] and "author" in data["meta"]:
-                meta["channel"] = self.bot.get_channel(data["meta"]["channel"])
-                meta["author"] = meta["channel"].server.get_member(data["meta"]["author"])
+                meta["channel_id"] = data["meta"]["channel"]
+                meta["author_id"] = data["meta"]["author"]
 
             meta["seek"] = data["meta"].get("seek", 0)
 
-            if "http" in data["url"].lower():
-                asyncio.ensure_future(self.add_entry(data["url"], saved=True, **meta), loop=self.bot.loop)
+            if "http" not in data["url"].lower():
+                self.persist('lrem', 1, item)
+                continue
+
+            if data.get("version", 1) >= 2 and data.get("expected_filename", None):
+                entry = URLPlaylistEntry(
+                    playlist=self,
+                    url=data["url"],
+                    title=data.get("title", None) or data["url"],
+                    duration=data.get("duration", 0) or 0,
+                    expected_filename=data.get("expected_filename", None),
+                    extractor=data.get("extractor", None),
+                    id=data.get("id", None),
+                    **meta
+                )
             else:
-                self.redis.lrem("musicbot:queue:" + self.serverid, 1, item)
+                # Never looked up, or saved by an older version.
+                entry = LazyPlaylistEntry(
+                    playlist=self,
+                    url=data["url"],
+                    title=data.get("title", None),
+                    duration=data.get("duration", 0) or 0,
+                    extractor=data.get("extractor", None),
+                    id=data.get("id", None),
+                    **meta
+                )
+
+            entry.needs_validation = True
+            restored.append(entry)
+
+        self.add_entries(restored, saved=True)
+
+        if self.mode != 'fifo':
+            self._retag()
+
+    def set_mode(self, mode):
+        """
+            Changes the order songs are played in:
+
+            - fifo plays songs in the order they were queued.
+            - roundrobin takes turns between the authors with songs in the queue, one song each.
+            - fair takes turns weighted by the authors' `QueueWeight` permission, an author with a weight of 2 gets
+              two songs played for every song of an author with a weight of 1.
+
+            The fair modes give each song a virtual finish tag, the later of the tag of the song that played last and
+            the tag of the author's previous song, plus 1 / weight.  The queue is kept sorted by tag, so it always is
+            the order the songs will play in and positions and time estimates stay right.  Songs queued to play next
+            skip the line.
+        """
+        if mode not in QUEUE_MODES:
+            raise ValueError("Unknown queue mode %s" % mode)
+
+        self.mode = mode
+        self.bot.write_behind.write('set', self.mode_key, mode)
+
+        if mode != 'fifo':
+            self._reorder()
+
+    def _weight(self, entry):
+        author = entry.author if self.mode == 'fair' else None
+        if author is not None:
+            return self.bot.permissions.for_user(author).queue_weight
+
+        return 1
+
+    def _schedule(self, entry):
+        """
+            Tags `entry` for the fair queue modes and inserts it where its tag belongs, returning its position.
+        """
+        start = max(self._virtual_time, self._finish.get(entry.author_id, 0))
+
+        entry.fair_tag = start + 1 / self._weight(entry)
+        self._finish[entry.author_id] = entry.fair_tag
+
+        position = self.entries.bisect(entry.fair_tag, key=lambda e: e.fair_tag)
+        self.entries.insert(position, entry)
+        return position
+
+    def _reorder(self):
+        """
+            Puts the queue in the order of the current fair mode, keeping the order of each author's songs.
+        """
+        entries = list(self.entries)
+
+        self.entries.clear()
+        self._finish = {}
+        for entry in entries:
+            self._schedule(entry)
+
+        if list(self.entries) != entries:
+            self.persist('delete')
+            self.persist('rpush', *[entry.to_json() for entry in self.entries])
+
+    def _retag(self):
+        """
+            Tags the queue for the fair modes without changing its order, for a queue restored as it was saved.  Each
+            song gets its author's next tag, or the tag of the song before it if that's later.
+        """
+        self._finish = {}
+        tag = self._virtual_time
+
+        for entry in self.entries:
+            start = max(self._virtual_time, self._finish.get(entry.author_id, 0))
+            tag = max(tag, start + 1 / self._weight(entry))
+
+            entry.fair_tag = tag
+            self._finish[entry.author_id] = tag
+
+    def _reset_tags(self):
+        # The queue is in no tag order anymore, everything queued after this goes after what's there.
+        for entry in self.entries:
+            entry.fair_tag = self._virtual_time
+        self._finish = {}
 
     def shuffle(self, seed=None):
         if seed:
             random.seed(seed)
 
-        random.shuffle(self.entries)
-        self.redis.delete("musicbot:queue:" + self.serverid)
-        self.redis.rpush("musicbot:queue:" + self.serverid, *[entry.to_json() for entry in self.entries])
+        self.entries.shuffle()
+        self._reset_tags()
+        self.persist('delete')
+        if self.entries:
+            self.persist('rpush', *[entry.to_json() for entry in self.entries])
         random.seed()
 
     def clear(self, kill=False, last_entry=None):
         self.entries.clear()
+        self._finish = {}
 
         if kill and last_entry:
-            self.redis.lpush("musicbot:queue:" + self.serverid, last_entry.to_json())
+            self.persist('lpush', last_entry.to_json())
         else:
-            self.redis.delete("musicbot:queue:" + self.serverid)
+            self.persist('delete')
+
+    def remove_entry(self, entry):
+        """
+            Takes `entry` out of the queue, raises ValueError if it isn't queued.
+        """
+        position = self.entries.index(entry)
+        self.entries.remove(entry)
+
+        # Removed by position, the same song can be queued twice and the saved record can be older than the entry.
+        self.persist('lset', position, GAP)
+        self.persist('lrem', 1, GAP)
+
+    def update_entry(self, entry):
+        """
+            Picks up the changed info of a queued `entry`: time estimates and the listing of the queue depend on its
+            duration and title, and its saved record is replaced.  Does nothing if it isn't queued.
+        """
+        if entry not in self.entries:
+            return
+
+        self.entries.update(entry)
+        self.persist('lset', self.entries.index(entry), entry.to_json())
 
     async def add_entry(self, song_url, saved=False, prepend=False, **meta):
         """
@@ -100,7 +268,14 @@ class Playlist(EventEmitter):
             :param song_url: The song url to add to the playlist.
             :param meta: Any additional metadata to add to the playlist entry.
         """
+        entry = await self._make_entry(song_url, **meta)
+        position = self._add_entry(entry, saved, prepend)
+        return entry, position + 1
 
+    async def _make_entry(self, song_url, **meta):
+        """
+            Looks up and validates a song_url, returning an entry for it that hasn't been added yet.
+        """
         try:
             info = await self.downloader.extract_info(self.loop, song_url, download=False)
         except Exception as e:
@@ -149,26 +324,29 @@ class Playlist(EventEmitter):
             url=song_url,
             title=info.get('title', 'Untitled'),
             duration=info.get('duration', 0) or 0,
-            expected_filename=self.downloader.ytdl.prepare_filename(info),
+            expected_filename=self.downloader.prepare_filename(info),
+            extractor=info.get('extractor', None),
+            id=info.get('id', None),
             **meta
         )
-        self._add_entry(entry, saved, prepend)
-        return entry, len(self.entries)
+        return entry
 
-    async def import_from(self, playlist_url, **meta):
+    async def import_from(self, playlist_url, max_duration=0, **meta):
         """
-            Imports the songs from `playlist_url` and queues them to be played.
+            Imports the songs from `playlist_url` and queues them to be played.  Songs the playlist's listing doesn't
+            fully describe are queued as `LazyPlaylistEntry`s.
 
             Returns a list of `entries` that have been enqueued.
 
             :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
+            :param max_duration: The longest a lazy entry may turn out to be, in seconds
             :param meta: Any additional metadata to add to the playlist entry
         """
         position = len(self.entries) + 1
         entry_list = []
 
         try:
-            info = await self.downloader.safe_extract_info(self.loop, playlist_url, download=False)
+            info = await self.downloader.safe_extract_info(self.loop, playlist_url, download=False, process=False)
         except Exception as e:
             raise ExtractionError('Could not extract information from {}\n\n{}'.format(playlist_url, e))
 
@@ -185,16 +363,30 @@ class Playlist(EventEmitter):
         for items in info['entries']:
             if items:
                 try:
-                    entry = URLPlaylistEntry(
-                        playlist=self,
-                        url=items[url_field],
-                        title=items.get('title', 'Untitled'),
-                        duration=items.get('duration', 0) or 0,
-                        expected_filename=self.downloader.ytdl.prepare_filename(items),
-                        **meta
-                    )
-
-                    self._add_entry(entry)
+                    if 'ext' in items:
+                        entry = URLPlaylistEntry(
+                            playlist=self,
+                            url=items[url_field],
+                            title=items.get('title', 'Untitled'),
+                            duration=items.get('duration', 0) or 0,
+                            expected_filename=self.downloader.prepare_filename(items),
+                            extractor=items.get('extractor', None),
+                            id=items.get('id', None),
+                            **meta
+                        )
+                    else:
+                        url, extractor = self._flat_entry_url(items, url_field)
+                        entry = LazyPlaylistEntry(
+                            playlist=self,
+                            url=url,
+                            title=items.get('title', None),
+                            duration=items.get('duration', 0) or 0,
+                            extractor=extractor,
+                            id=items.get('id', None),
+                            max_duration=max_duration,
+                            **meta
+                        )
+
                     entry_list.append(entry)
                 except:
                     baditems += 1
@@ -209,13 +401,35 @@ class Playlist(EventEmitter):
         if baditems:
             log.info("Skipped %s bad entries", baditems)
 
+        if entry_list:
+            position = self.add_entries(entry_list) + 1
+
         return entry_list, position
 
-    async def async_process_youtube_playlist(self, playlist_url, **meta):
+    @staticmethod
+    def _flat_entry_url(items, url_field):
+        """
+            Returns the canonical url and the extractor of a song in a playlist listing that wasn't processed.  Youtube
+            listings only give the video id as the url of their songs.
+        """
+        url = items.get(url_field, None) or items['url']
+        extractor = items.get('extractor', None)
+
+        if items.get('ie_key', None) == 'Youtube':
+            extractor = 'youtube'
+            if not url.startswith(('http://', 'https://')):
+                url = 'https://www.youtube.com/watch?v=%s' % (items.get('id', None) or url)
+
+        return canonicalize(url), extractor
+
+    async def async_process_youtube_playlist(self, playlist_url, progress=None, max_duration=0, **meta):
         """
-            Processes youtube playlists links from `playlist_url` in a questionable, async fashion.
+            Processes youtube playlists links from `playlist_url` in a questionable, async fashion.  Songs with a
+            title in the playlist's listing are queued as `LazyPlaylistEntry`s without being looked up.
 
             :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
+            :param progress: An `ImportProgress` to keep up to date while the songs are added
+            :param max_duration: The longest a lazy entry may turn out to be, in seconds
             :param meta: Any additional metadata to add to the playlist entry
         """
 
@@ -227,36 +441,38 @@ class Playlist(EventEmitter):
         if not info:
             raise ExtractionError('Could not extract information from %s' % playlist_url)
 
-        gooditems = []
-        baditems = 0
+        baseurl = info['webpage_url'].split('playlist?list=')[0]
+        songs = []
         for entry_data in info['entries']:
-            if entry_data:
-                baseurl = info['webpage_url'].split('playlist?list=')[0]
-                song_url = baseurl + 'watch?v=%s' % entry_data['id']
+            if not entry_data:
+                songs.append(None)
+                continue
 
-                try:
-                    entry, elen = await self.add_entry(song_url, **meta)
-                    gooditems.append(entry)
-                except ExtractionError:
-                    baditems += 1
-                except Exception as e:
-                    baditems += 1
-                    log.error("There was an error adding the song {}: {}: {}\n".format(
-                        entry_data['id'], e.__class__.__name__, e
-                    ))
+            song_url = baseurl + 'watch?v=%s' % entry_data['id']
+            if entry_data.get('title', None):
+                songs.append(LazyPlaylistEntry(
+                    playlist=self,
+                    url=song_url,
+                    title=entry_data['title'],
+                    duration=entry_data.get('duration', 0) or 0,
+                    extractor='youtube',
+                    id=entry_data['id'],
+                    max_duration=max_duration,
+                    **meta
+                ))
             else:
-                baditems += 1
+                songs.append(song_url)
 
-        if baditems:
-            log.info("Skipped %s bad entries" % baditems)
+        return await self._ingest(songs, progress, **meta)
 
-        return gooditems
-
-    async def async_process_sc_bc_playlist(self, playlist_url, **meta):
+    async def async_process_sc_bc_playlist(self, playlist_url, progress=None, max_duration=0, **meta):
         """
             Processes soundcloud set and bancdamp album links from `playlist_url` in a questionable, async fashion.
+            Songs with a title in the playlist's listing are queued as `LazyPlaylistEntry`s without being looked up.
 
             :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
+            :param progress: An `ImportProgress` to keep up to date while the songs are added
+            :param max_duration: The longest a lazy entry may turn out to be, in seconds
             :param meta: Any additional metadata to add to the playlist entry
         """
 
@@ -268,66 +484,244 @@ class Playlist(EventEmitter):
         if not info:
             raise ExtractionError('Could not extract information from %s' % playlist_url)
 
-        gooditems = []
-        baditems = 0
+        songs = []
         for entry_data in info['entries']:
-            if entry_data:
-                song_url = entry_data['url']
-
-                try:
-                    entry, elen = await self.add_entry(song_url, **meta)
-                    gooditems.append(entry)
-                except ExtractionError:
-                    baditems += 1
-                except Exception as e:
-                    baditems += 1
-                    log.error("There was an error adding the song {}: {}: {}\n".format(
-                        entry_data['id'], e.__class__.__name__, e
-                    ))
+            if not entry_data:
+                songs.append(None)
+            elif entry_data.get('title', None):
+                songs.append(LazyPlaylistEntry(
+                    playlist=self,
+                    url=entry_data['url'],
+                    title=entry_data['title'],
+                    duration=entry_data.get('duration', 0) or 0,
+                    id=entry_data.get('id', None),
+                    max_duration=max_duration,
+                    **meta
+                ))
             else:
-                baditems += 1
+                songs.append(entry_data['url'])
 
-        if baditems:
-            log.info("Skipped %s bad entries" % baditems)
+        return await self._ingest(songs, progress, **meta)
 
-        return gooditems
+    async def _ingest(self, songs, progress=None, **meta):
+        """
+            Looks up the song urls in `songs` with up to `import_concurrency` lookups running at once and adds the
+            songs to the queue in the order of `songs`, each one as soon as it and the ones before it are done.  Entries
+            in `songs` are added as they are.  Missing (None) and broken urls are skipped and counted as failed.
+
+            Returns the entries that were added.
+        """
+        progress = progress or ImportProgress()
+        progress.total = len(songs)
+
+        window = deque()
+        pending = iter(songs)
+        concurrency = max(1, self.bot.config.import_concurrency)
+        lookups = 0
+
+        def fill():
+            nonlocal lookups
+
+            # Only lookups count towards the window, songs that don't need one can be added right away.
+            while lookups < concurrency:
+                song_url = next(pending, StopIteration)
+                if song_url is StopIteration:
+                    return
+
+                if isinstance(song_url, URLPlaylistEntry):
+                    lookup = self.loop.create_future()
+                    lookup.set_result(song_url)
+                    window.append((song_url.url, lookup, False))
+                elif song_url:
+                    lookup = asyncio.ensure_future(self._make_entry(song_url, **meta), loop=self.loop)
+                    window.append((song_url, lookup, True))
+                    lookups += 1
+                else:
+                    window.append((song_url, None, False))
+
+        try:
+            fill()
+
+            while window:
+                if window[0][1] and not window[0][1].done():
+                    await asyncio.wait([window[0][1]])
+
+                # Everything that's ready at the front of the window is added together.
+                batch = []
+                while window and (window[0][1] is None or window[0][1].done()):
+                    song_url, lookup, counted = window.popleft()
+                    if counted:
+                        lookups -= 1
+
+                    try:
+                        if lookup is None:
+                            raise ExtractionError('Missing playlist entry')
+
+                        batch.append(lookup.result())
+                    except ExtractionError:
+                        progress.failed += 1
+                    except Exception as e:
+                        progress.failed += 1
+                        log.error("There was an error adding the song {}: {}: {}\n".format(
+                            song_url, e.__class__.__name__, e
+                        ))
+                    finally:
+                        progress.processed += 1
+
+                    fill()
+
+                self.add_entries(batch)
+                progress.entries.extend(batch)
+        finally:
+            # Whatever is still in flight when the import is cancelled isn't needed anymore.
+            for song_url, lookup, counted in window:
+                if lookup:
+                    lookup.cancel()
+
+            progress.done = True
+
+        if progress.failed:
+            log.info("Skipped %s bad entries" % progress.failed)
+
+        return progress.entries
 
     def _add_entry(self, entry, saved=False, prepend=False):
-        if prepend:
-            self.entries.appendleft(entry)
+        """
+            Queues `entry` and returns its (0 based) position.
+        """
+        return self.add_entries([entry], position=0 if prepend else None, saved=saved)
+
+    def add_entries(self, entries, position=None, saved=False):
+        """
+            Queues `entries` in one go and returns the (0 based) position of the first one.
+
+            The entries go in at `position`, or at the end of the queue (where the fair queue modes put them when
+            `position` is None).  Saving them and counting their plays happens in a single batch of redis writes and
+            listeners get a single `entries-added` event.  `saved` entries were restored from redis and are only
+            added to the end.
+        """
+        if not entries:
+            return len(self.entries)
+
+        if position is not None and not saved:
+            # Entries put in a given place skip the fair order, they share the tag of the song before them.
+            position = max(0, min(len(self.entries), position))
+            tag = self.entries[position - 1].fair_tag if position else self._virtual_time
+
+            for offset, entry in enumerate(entries):
+                entry.fair_tag = tag
+                self.entries.insert(position + offset, entry)
+        elif saved or self.mode == 'fifo':
+            self.entries.extend(entries)
         else:
-            self.entries.append(entry)
+            for entry in entries:
+                self._schedule(entry)
 
         if not saved:
-            self.redis.hincrby("musicbot:played", entry.url, 1)
-            if prepend:
-                self.redis.lpush("musicbot:queue:" + self.serverid, entry.to_json())
+            self.bot.write_behind.write_many(self._queue_writes(entries))
+
+        self.emit('entries-added', playlist=self, entries=entries)
+
+        head = self.peek()
+        if head in entries:
+            head.get_ready_future()
+
+        return self.entries.index(entries[0])
+
+    def _queue_writes(self, entries):
+        """
+            Returns the redis writes that save newly queued `entries` and count their plays.
+        """
+        writes = []
+        for url, plays in Counter(canonicalize(entry.url) for entry in entries).items():
+            writes.append(('hincrby', "musicbot:played", (url, plays)))
+            self.bot.played_sampler.add(url, plays)
+
+        # New entries at the end of the queue are pushed in one go.  The others are inserted by position, first
+        # to last so everything before them is already saved: the entry after a run of new ones is swapped for a
+        # `GAP`, the run goes in before it and the entry is put back.
+        added = set(entries)
+        tail = []
+        for entry in reversed(list(self.entries.iter_from(len(self.entries) - len(entries)))):
+            if entry not in added:
+                break
+            tail.append(entry)
+
+        if tail:
+            tail.reverse()
+            writes.append(('rpush', self.queue_key, [entry.to_json() for entry in tail]))
+
+        added.difference_update(tail)
+        positions = sorted(self.entries.index(entry) for entry in added)
+
+        runs = []
+        for position in positions:
+            if runs and runs[-1][0] + runs[-1][1] == position:
+                runs[-1][1] += 1
             else:
-                self.redis.rpush("musicbot:queue:" + self.serverid, entry.to_json())
-        self.emit('entry-added', playlist=self, entry=entry)
+                runs.append([position, 1])
 
-        if self.peek() is entry:
-            entry.get_ready_future()
+        for position, count in runs:
+            values = [entry.to_json() for entry in islice(self.entries.iter_from(position), count)]
+
+            if position == 0:
+                writes.append(('lpush', self.queue_key, values[::-1]))
+                continue
 
-    async def get_next_entry(self, predownload_next=True):
+            following = self.entries[position + count]
+            writes.append(('lset', self.queue_key, (position, GAP)))
+            for value in values:
+                writes.append(('linsert', self.queue_key, ('BEFORE', GAP, value)))
+            writes.append(('lset', self.queue_key, (position + count, following.to_json())))
+
+        return writes
+
+    async def get_next_entry(self, predownload_next=True, stream=False):
         """
             A coroutine which will return the next song or None if no songs left to play.
 
             Additionally, if predownload_next is set to True, it will attempt to download the next
             song to be played - so that it's ready by the time we get to it.
+
+            If stream is set to True and the song isn't downloaded yet, the song is returned as soon as it can be
+            streamed from its source (see `URLPlaylistEntry.prepare_stream`) while the download carries on.
+
+            Lazy entries that can't be looked up are skipped.
         """
-        if not self.entries:
-            return None
+        while self.entries:
+            entry = self.entries.popleft()
+            self.persist('lpop')
+            self._virtual_time = max(self._virtual_time, entry.fair_tag)
+
+            if predownload_next:
+                next_entry = self.peek()
+                if next_entry:
+                    next_entry.get_ready_future()
+
+            try:
+                return await self._get_ready(entry, stream)
+            except ExtractionError as e:
+                if not isinstance(entry, LazyPlaylistEntry):
+                    raise
 
-        entry = self.entries.popleft()
-        self.redis.lpop("musicbot:queue:" + self.serverid)
+                log.info("Dropped %s from the queue: %s", entry.url, e)
 
-        if predownload_next:
-            next_entry = self.peek()
-            if next_entry:
-                next_entry.get_ready_future()
+    async def _get_ready(self, entry, stream):
+        ready_future = entry.get_ready_future()
 
-        return await entry.get_ready_future()
+        if stream and not ready_future.done():
+            stream_future = asyncio.ensure_future(entry.prepare_stream(), loop=self.loop)
+            await asyncio.wait([ready_future, stream_future], return_when=asyncio.FIRST_COMPLETED)
+
+            # A cached file beats streaming.
+            if not ready_future.done() and await stream_future:
+                # Nobody is going to wait on the download now, don't let its errors go unretrieved.
+                ready_future.add_done_callback(lambda future: future.cancelled() or future.exception())
+                return entry
+
+            stream_future.cancel()
+
+        return await ready_future
 
     def peek(self):
         """
@@ -336,17 +730,76 @@ class Playlist(EventEmitter):
         if self.entries:
             return self.entries[0]
 
+    def _seconds_until(self, position, player):
+        estimated_time = self.entries.duration_until(position - 1)
+
+        # When the player plays a song, it eats the first playlist item, so we just have to add the time back
+        if player and not player.is_stopped and player.current_entry:
+            estimated_time += player.current_entry.duration - player.progress
+
+        return estimated_time
+
     async def estimate_time_until(self, position, player):
         """
             (very) Roughly estimates the time till the queue will 'position'
         """
-        estimated_time = sum([e.duration for e in islice(self.entries, position - 1)])
+        return datetime.timedelta(seconds=self._seconds_until(position, player))
 
-        # When the player plays a song, it eats the first playlist item, so we just have to add the time back
-        if not player.is_stopped and player.current_entry:
-            estimated_time += player.current_entry.duration - player.progress
+    def deadline_for(self, entry):
+        """
+            Returns the loop time at which `entry` is expected to start playing.  Entries that aren't queued anymore
+            are about to be played, so they are needed right away.
+        """
+        try:
+            position = self.entries.index(entry) + 1
+        except ValueError:
+            return self.loop.time()
+
+        return self.loop.time() + self._seconds_until(position, self.bot.players.get(self.serverid, None))
+
+    @staticmethod
+    def describe(position, entry, title_limit=0):
+        title = entry.title
+        if title_limit and len(title) > title_limit:
+            title = title[:title_limit - 3] + '...'
 
-        return datetime.timedelta(seconds=estimated_time)
+        if entry.meta.get('channel', False) and entry.meta.get('author', False):
+            return '`{}.` **{}** added by **{}**'.format(position, title, entry.meta['author'].name).strip()
+
+        return '`{}.` **{}**'.format(position, title).strip()
+
+    @property
+    def page_count(self):
+        return -(-len(self.entries) // QUEUE_PAGE_SIZE)
+
+    def render_page(self, page):
+        """
+            Returns the lines listing page `page` (1 based) of the queue.  Only the songs on the page are looked at,
+            and pages are kept until the queue changes.
+        """
+        if self._pages_version != self.entries.version:
+            self._pages.clear()
+            self._pages_version = self.entries.version
+
+        lines = self._pages.get(page, None)
+        if lines is None:
+            start = (page - 1) * QUEUE_PAGE_SIZE
+            entries = self.entries.iter_from(start)
+
+            lines = [
+                self.describe(position, entry, QUEUE_TITLE_LIMIT)
+                for position, entry in zip(range(start + 1, start + QUEUE_PAGE_SIZE + 1), entries)
+            ]
+            self._pages[page] = lines
+
+        return lines
+
+    def export(self, data):
+        """
+            Writes the whole queue to the binary file `data`, a line per song.
+        """
+        for position, entry in enumerate(self.entries, 1):
+            data.write(self.describe(position, entry).encode('utf8') + b'\n')
 
     def count_for_user(self, user):
-        return sum(1 for e in self.entries if e.meta.get('author', None) == user)
+        return self.entries.count_for(user.id if user else None)
@@ -0,0 +1,323 @@
+import functools
+import logging
+import queue
+import threading
+import traceback
+
+import asyncio
+import redis
+from musicbot.connections import redis_binary_pool, redis_pool
+
+log = logging.getLogger(__name__)
+
+# The most commands sent to redis in one pipeline.
+MAX_BATCH = 512
+
+# The redis commands `Storage` offers as coroutines.
+storage_commands = {
+    'get', 'setex', 'delete', 'exists', 'expire', 'ttl',
+    'lrange', 'llen', 'rpush', 'lpush', 'lpop', 'lrem',
+    'hget', 'hmget', 'hgetall', 'hincrby', 'hlen', 'hscan',
+    'sadd', 'spop', 'srandmember', 'smembers', 'sismember'
+}
+
+# Writes are sent at most this many seconds after they're made...
+FLUSH_INTERVAL = 0.1
+
+# ...or right away once this many have piled up.
+FLUSH_THRESHOLD = 256
+
+# Commands that change a list, all of them are made pointless by deleting the list afterwards.
+list_commands = {'rpush', 'lpush', 'linsert', 'lset', 'lpop', 'rpop', 'lrem', 'delete'}
+
+
+class Storage:
+    """
+        The event loop's way to talk to redis.  Commands run on one dedicated thread, so a slow redis (fsyncing its
+        append only file, for example) makes the commands waiting on it slow but never stalls the loop itself.
+
+        Every command in `storage_commands` is available as a method returning a future, for example
+        `await storage.hincrby("musicbot:played", url, 1)`.  Pass `binary=True` for values that aren't text.
+        Commands that pile up while the thread is busy are sent together in a single pipeline.
+
+        `call` runs a function with the redis client on the same thread, for things that take several dependent
+        commands (migrations).  `transaction` sends a list of writes as one MULTI/EXEC.  Everything runs in the order
+        it was submitted.
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.redis = redis.StrictRedis(connection_pool=redis_pool)
+        self.binary_redis = redis.StrictRedis(connection_pool=redis_binary_pool)
+
+        self.commands = 0
+        self.batches = 0
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._work, name='Redis I/O', daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        if name in storage_commands:
+            return functools.partial(self.execute, name)
+
+        raise AttributeError(name)
+
+    def execute(self, command, *args, binary=False):
+        future = self.loop.create_future()
+        self._queue.put(('command', (command, args, binary), future))
+        return future
+
+    def call(self, f, *args):
+        future = self.loop.create_future()
+        self._queue.put(('call', (f, args), future))
+        return future
+
+    def transaction(self, commands):
+        """
+            Applies a list of (command, key, args) writes atomically.
+        """
+        future = self.loop.create_future()
+        self._queue.put(('transaction', commands, future))
+        return future
+
+    def _work(self):
+        while True:
+            batch = [self._queue.get()]
+
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Consecutive commands share a pipeline, calls and transactions run on their own in between.
+            commands = []
+            for item in batch:
+                if item is None:
+                    self._run_commands(commands)
+                    return
+
+                if item[0] == 'command':
+                    commands.append(item)
+                    continue
+
+                self._run_commands(commands)
+                commands = []
+
+                kind, payload, future = item
+                try:
+                    if kind == 'call':
+                        f, args = payload
+                        result = f(self.redis, *args)
+                    else:
+                        pipe = self.redis.pipeline(transaction=True)
+                        for command, key, args in payload:
+                            getattr(pipe, command)(key, *args)
+                        result = pipe.execute()
+                except Exception as e:
+                    self._resolve(future, exception=e)
+                else:
+                    self._resolve(future, result)
+
+            self._run_commands(commands)
+
+    def _run_commands(self, commands):
+        if not commands:
+            return
+
+        self.commands += len(commands)
+        self.batches += 1
+
+        pipes = {
+            False: self.redis.pipeline(transaction=False),
+            True: self.binary_redis.pipeline(transaction=False)
+        }
+
+        for kind, (command, args, binary), future in commands:
+            getattr(pipes[binary], command)(*args)
+
+        results = {}
+        for binary, pipe in pipes.items():
+            if not len(pipe):
+                continue
+
+            try:
+                results[binary] = iter(pipe.execute(raise_on_error=False))
+            except Exception as e:
+                results[binary] = e
+
+        for kind, (command, args, binary), future in commands:
+            result = results[binary]
+
+            if isinstance(result, Exception):
+                self._resolve(future, exception=result)
+                continue
+
+            value = next(result)
+            if isinstance(value, Exception):
+                self._resolve(future, exception=value)
+            else:
+                self._resolve(future, value)
+
+    def _resolve(self, future, result=None, exception=None):
+        def resolve():
+            if future.cancelled():
+                return
+
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+        try:
+            self.loop.call_soon_threadsafe(resolve)
+        except RuntimeError:
+            # The loop is closed, nobody is waiting anymore.
+            pass
+
+    def close(self):
+        """
+            Runs everything that was submitted and stops the thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "waiting": self._queue.qsize(),
+            "commands": self.commands,
+            "batches": self.batches
+        }
+
+
+class WriteBehind:
+    """
+        Collects redis writes and sends them in batches, each batch as one MULTI/EXEC transaction, so that the event
+        loop never waits on redis for a write and a 500 song import takes a couple of round trips instead of 1000.
+
+        Batches are sent `FLUSH_INTERVAL` seconds after the first write in them, or as soon as `FLUSH_THRESHOLD` writes
+        are waiting, by a single thread and in order.  A crash loses at most the writes of the last `FLUSH_INTERVAL`
+        seconds plus the batch being sent.  `close` sends whatever is left on shutdown.
+
+        MULTI/EXEC doesn't roll back a command that fails while the batch runs, so a failed batch may be partly
+        applied.  Lists registered with `mirror` are edited by position and would stay wrong from then on, so after a
+        failed batch that touched one it's rewritten in full from its in-memory copy.  Other writes of the batch are
+        lost.
+
+        Consecutive pushes to the same list are merged into one command and a `delete` drops the list writes before
+        it that haven't been sent yet.
+    """
+
+    def __init__(self, storage, interval=FLUSH_INTERVAL, threshold=FLUSH_THRESHOLD):
+        self.storage = storage
+        self.loop = storage.loop
+        self.interval = interval
+        self.threshold = threshold
+
+        self.batches = 0
+        self.writes = 0
+
+        self._commands = []
+        self._count = 0
+        self._handle = None
+
+        # Functions returning the current contents of the mirrored lists, by key.
+        self._mirrors = {}
+
+    def __len__(self):
+        return self._count
+
+    def mirror(self, key, contents):
+        """
+            Registers the list at `key` as a copy of something kept in memory.  `contents` returns the values it
+            should hold, it's called to rewrite the list after a batch that touched it failed.
+        """
+        self._mirrors[key] = contents
+
+    def write(self, command, key, *args):
+        """
+            Queues `command` (the name of a StrictRedis method) to be run with `key` and `args`.
+        """
+        self._append(command, key, args)
+        self._schedule()
+
+    def write_many(self, commands):
+        """
+            Queues a list of (command, key, args) writes, which are sent in the same batch.
+        """
+        for command, key, args in commands:
+            self._append(command, key, args)
+        self._schedule()
+
+    def _append(self, command, key, args):
+        last = self._commands[-1] if self._commands else None
+
+        if command in ('rpush', 'lpush') and last and last[0] == command and last[1] == key:
+            last[2].extend(args)
+
+        else:
+            if command == 'delete':
+                self._commands = [c for c in self._commands if c[1] != key or c[0] not in list_commands]
+
+            self._commands.append((command, key, list(args)))
+
+        self._count += 1
+        self.writes += 1
+
+    def _schedule(self):
+        if self._count >= self.threshold:
+            self.flush()
+        elif self._handle is None:
+            self._handle = self.loop.call_later(self.interval, self.flush)
+
+    def flush(self):
+        """
+            Sends the waiting writes.  Returns a future that's done once they have been applied.
+        """
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+
+        commands, self._commands, self._count = self._commands, [], 0
+
+        future = self.storage.transaction(commands)
+        future.add_done_callback(functools.partial(self._sent, commands))
+        return future
+
+    def _sent(self, commands, future):
+        if future.cancelled():
+            return
+
+        if not future.exception():
+            self.batches += 1
+            return
+
+        log.error("Could not save %s queued writes", len(commands))
+        traceback.print_exception(type(future.exception()), future.exception(), None)
+
+        # The writes sent after this batch are already in the copy, the ones still waiting are dropped by the delete.
+        for key in {key for command, key, args in commands if key in self._mirrors}:
+            log.warning("Rewriting %s", key)
+            self.write('delete', key)
+
+            values = self._mirrors[key]()
+            if values:
+                self.write('rpush', key, *values)
+
+    def close(self):
+        """
+            Hands the waiting writes to the storage thread.  `Storage.close` waits for them to be applied.
+        """
+        if self._commands:
+            self.flush()
+        elif self._handle:
+            self._handle.cancel()
+            self._handle = None
+
+    def stats(self):
+        return {
+            "waiting": self._count,
+            "writes": self.writes,
+            "batches": self.batches
+        }
@@ -17,6 +17,28 @@ class SkipState:
         return self.skip_count
 
 
+class ImportProgress:
+    """
+        How far along a playlist import is.  Updated by the playlist while it works through the songs, so whoever
+        started the import can keep an eye on it.
+    """
+
+    def __init__(self, total=0):
+        self.total = total
+        self.processed = 0
+        self.failed = 0
+        self.entries = []
+        self.done = False
+
+    @property
+    def added(self):
+        return len(self.entries)
+
+    @property
+    def remaining(self):
+        return self.total - self.processed
+
+
 class Response:
     def __init__(self, content, reply=False, delete_after=0):
         self.content = content
@@ -2,10 +2,13 @@ import bisect
 import decimal
 import hashlib
 import itertools
+import mmap
+import os
 import random
 
 import aiohttp
 from musicbot.config import Config, ConfigDefaults
+from musicbot.lib.urls import canonicalize
 from musicbot.permissions import Permissions, PermissionsDefaults
 
 
@@ -22,12 +25,26 @@ def load_config(context):
     context.permissions = Permissions(PermissionsDefaults.perms_file, grant_all=[context.config.owner_id])
 
 
-def md5sum(filename, limit=0):
-    fhash = hashlib.md5()
+def file_digest(filename, constructor, chunk_size=4 * 1024 * 1024):
+    """
+        Hashes a whole file through a memory map with `constructor` (`hashlib.md5`, for example) and returns the hex
+        digest.  This reads the entire file, so run it in an executor.
+    """
+    fhash = constructor()
     with open(filename, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            fhash.update(chunk)
-    return fhash.hexdigest()[-limit:]
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, len(view), chunk_size):
+                        fhash.update(view[offset:offset + chunk_size])
+                finally:
+                    view.release()
+    return fhash.hexdigest()
+
+
+def md5sum(filename, limit=0, chunk_size=4 * 1024 * 1024):
+    return file_digest(filename, hashlib.md5, chunk_size)[-limit:]
 
 
 def weighted_choice(items, diminish=None):
@@ -56,6 +73,20 @@ def migrate_redis(redis):
         redis.delete("musicbot:played")
         redis.hmset("musicbot:played", {key: 1 for key in items})
 
+    # Merge the play counts of different links to the same song.
+    if not redis.sismember("musicbot:migrations", "canonical_played"):
+        pipe = redis.pipeline()
+
+        for url, count in redis.hscan_iter("musicbot:played"):
+            canonical = canonicalize(url)
+
+            if canonical != url:
+                pipe.hincrby("musicbot:played", canonical, int(count))
+                pipe.hdel("musicbot:played", url)
+
+        pipe.sadd("musicbot:migrations", "canonical_played")
+        pipe.execute()
+
 
 async def get_header(session, url, headerfield=None, *, timeout=5):
     with aiohttp.Timeout(timeout):
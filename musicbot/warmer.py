@@ -0,0 +1,197 @@
+import heapq
+import logging
+import os
+import time
+from collections import deque
+
+import asyncio
+from musicbot.downloader import CACHE_TTL
+
+log = logging.getLogger(__name__)
+
+# How many play counts are fetched per HSCAN call.
+SCAN_COUNT = 1000
+
+
+class CacheWarmer:
+    """
+        Keeps the most played songs looked up and downloaded ahead of time, so that replays and surprise picks start
+        playing without waiting on a download.
+
+        The warmer wakes up every `interval` seconds and only does anything while no server is waiting on a download.
+        Its downloads go through the download scheduler without a deadline, so songs people queued always go first.
+        It stops for the hour after downloading `bandwidth_budget` bytes and stops adding songs once the files it
+        downloaded take up `disk_budget` bytes.
+    """
+
+    def __init__(self, bot, songs=0, interval=300, bandwidth_budget=0, disk_budget=0):
+        self.bot = bot
+        self.loop = bot.loop
+        self.downloader = bot.downloader
+
+        self.songs = songs
+        self.interval = interval
+        self.bandwidth_budget = bandwidth_budget
+        self.disk_budget = disk_budget
+
+        self.downloads = 0
+        self.failures = 0
+
+        # Files the warmer downloaded and the (time, size) of each download for the bandwidth budget.
+        self._warmed = set()
+        self._history = deque()
+        self._task = None
+
+    def start(self):
+        if self.songs and self._task is None:
+            self._task = asyncio.ensure_future(self._run(), loop=self.loop)
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    @property
+    def is_idle(self):
+        scheduler = self.downloader.scheduler
+        if scheduler.running or scheduler.queue_depth:
+            return False
+
+        for player in self.bot.players.values():
+            for entry in (player.current_entry, player.playlist.peek()):
+                if entry and not entry.is_downloaded:
+                    return False
+
+        return True
+
+    @property
+    def disk_usage(self):
+        audio_cache = self.downloader.audio_cache
+        return sum(audio_cache.size_of(filename) for filename in self._warmed)
+
+    @property
+    def bandwidth_usage(self):
+        while self._history and self._history[0][0] < time.time() - 60 * 60:
+            self._history.popleft()
+
+        return sum(size for when, size in self._history)
+
+    def _over_budget(self):
+        if self.bandwidth_budget and self.bandwidth_usage >= self.bandwidth_budget:
+            return True
+
+        return bool(self.disk_budget and self.disk_usage >= self.disk_budget)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            try:
+                await self.warm()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Cache warming failed")
+
+    async def _top_played(self):
+        """
+            Returns the (url, plays) of the `songs` most played songs.  The play counts are walked with HSCAN, so
+            neither redis nor the loop ever handle the whole hash at once, and only the top songs are kept.
+        """
+        top = []
+        cursor = 0
+
+        while True:
+            cursor, played = await self.downloader.storage.hscan("musicbot:played", cursor, None, SCAN_COUNT)
+
+            for url, plays in played.items():
+                if not url.lower().startswith(('http://', 'https://')):
+                    continue
+
+                item = (int(plays), url)
+                if len(top) < self.songs:
+                    heapq.heappush(top, item)
+                elif item > top[0]:
+                    heapq.heapreplace(top, item)
+
+            if not cursor:
+                break
+
+        return [(url, plays) for plays, url in sorted(top, reverse=True)]
+
+    async def _info_is_stale(self, url):
+        # Info that has less than half of its time in the cache left gets looked up again, see `warm`.
+        ttl = await self.downloader.storage.ttl(self.downloader.cache_key(url))
+        return ttl is None or ttl < CACHE_TTL / 2
+
+    def _cached_file(self, info, expected_filename):
+        audio_cache = self.downloader.audio_cache
+        extractor, id = info.get('extractor', None), info.get('id', None)
+
+        # Found by the `extractor-id-` start of the name, like queued songs are.
+        if extractor and id and extractor != 'generic':
+            return audio_cache.find_prefix(self.downloader.filename_prefix(extractor, id), touch=False)
+
+        stem = os.path.basename(expected_filename).rsplit('.', 1)[0]
+        return audio_cache.find_generic(stem, touch=False)
+
+    async def warm(self):
+        """
+            Looks up the most played songs and downloads the ones that aren't in the audio cache.
+        """
+        if not self.is_idle or self._over_budget():
+            return
+
+        warmed = 0
+
+        for url, plays in await self._top_played():
+            if not self.is_idle or self._over_budget():
+                break
+
+            # Stale info is extracted again, which caches it for another `CACHE_TTL` even if the file is there.
+            try:
+                refresh = await self._info_is_stale(url)
+                info = await self.downloader.extract_info(self.loop, url, download=False, cache=not refresh)
+            except Exception as e:
+                log.debug("Could not look up %s for warming: %s", url, e)
+                continue
+
+            if not info or info.get('_type', None) == 'playlist':
+                continue
+
+            expected_filename = self.downloader.prepare_filename(info)
+            if self._cached_file(info, expected_filename):
+                continue
+
+            generic = os.path.basename(expected_filename).split('-')[0] == 'generic'
+
+            try:
+                filename = await self.downloader.scheduler.run(
+                    ('warm', url),
+                    lambda: self.downloader.download(self.loop, url, hash=generic)
+                )
+            except Exception as e:
+                log.info("Could not warm %s: %s", url, e)
+                self.failures += 1
+                continue
+
+            self.downloader.audio_cache.mark_warmed(filename)
+            self._warmed.add(filename)
+            self._history.append((time.time(), self.downloader.audio_cache.size_of(filename)))
+            self.downloads += 1
+            warmed += 1
+
+        if warmed:
+            audio_cache = self.downloader.audio_cache
+            log.info(
+                "Warmed %s songs, %s of %s cache hits were warmed songs so far",
+                warmed, audio_cache.warm_hits, audio_cache.hits
+            )
+
+    def stats(self):
+        return {
+            "downloads": self.downloads,
+            "failures": self.failures,
+            "disk_usage": self.disk_usage,
+            "bandwidth_usage": self.bandwidth_usage
+        }
@@ -0,0 +1,210 @@
+import time
+
+import asyncio
+import pytest
+from musicbot.storage import Storage, WriteBehind
+
+# How long the stand-in redis takes per round trip, like one fsyncing its append only file.
+DELAY = 0.05
+
+# The worst loop lag that still counts as not blocked.
+MAX_LAG = DELAY / 2
+
+
+class SlowRedis:
+    """
+        A redis stand-in that keeps its data in dicts and sleeps `delay` seconds for every command or pipeline.
+    """
+
+    def __init__(self, delay=DELAY):
+        self.delay = delay
+        self.round_trips = 0
+        self.fail_next = False
+        self.lists = {}
+        self.hashes = {}
+
+    def _command(self, name, *args):
+        return getattr(self, '_' + name)(*args)
+
+    def __getattr__(self, name):
+        if not hasattr(type(self), '_' + name):
+            raise AttributeError(name)
+
+        def command(*args):
+            self.round_trips += 1
+            time.sleep(self.delay)
+            return self._command(name, *args)
+
+        return command
+
+    def pipeline(self, transaction=True):
+        return SlowPipeline(self)
+
+    def _rpush(self, key, *values):
+        self.lists.setdefault(key, []).extend(values)
+        return len(self.lists[key])
+
+    def _delete(self, key):
+        return int(self.lists.pop(key, None) is not None)
+
+    def _lrange(self, key, start, end):
+        values = self.lists.get(key, [])
+        return values[start:] if end == -1 else values[start:end + 1]
+
+    def _hincrby(self, key, field, amount=1):
+        values = self.hashes.setdefault(key, {})
+        values[field] = values.get(field, 0) + amount
+        return values[field]
+
+    def _hget(self, key, field):
+        return self.hashes.get(key, {}).get(field, None)
+
+
+class SlowPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __getattr__(self, name):
+        def command(*args):
+            self.commands.append((name, args))
+            return self
+
+        return command
+
+    def execute(self, raise_on_error=True):
+        self.redis.round_trips += 1
+        time.sleep(self.redis.delay)
+
+        if self.redis.fail_next:
+            self.redis.fail_next = False
+            raise ConnectionError("lost the connection")
+
+        return [self.redis._command(name, *args) for name, args in self.commands]
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture
+def storage(loop):
+    storage = Storage(loop)
+    storage.redis = storage.binary_redis = SlowRedis()
+    yield storage
+    storage.close()
+
+
+async def _worst_lag(loop, done, interval=0.005):
+    worst = 0
+    while not done.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        worst = max(worst, loop.time() - start - interval)
+    return worst
+
+
+def _measure(loop, work):
+    async def run():
+        done = asyncio.Event()
+        lag = asyncio.ensure_future(_worst_lag(loop, done), loop=loop)
+        await asyncio.sleep(0.01)
+
+        try:
+            result = await work()
+        finally:
+            done.set()
+
+        return result, await lag
+
+    return loop.run_until_complete(run())
+
+
+def test_slow_redis_blocks_the_loop_when_called_directly(loop):
+    redis = SlowRedis()
+
+    async def work():
+        for _ in range(5):
+            redis.hincrby("musicbot:played", "https://example.com/a", 1)
+            await asyncio.sleep(0)
+
+    _, lag = _measure(loop, work)
+
+    # Make sure the lag measurement actually notices a blocked loop.
+    assert lag >= DELAY
+
+
+def test_storage_keeps_the_loop_responsive(loop, storage):
+    async def work():
+        for _ in range(5):
+            await storage.hincrby("musicbot:played", "https://example.com/a", 1)
+        return await storage.hget("musicbot:played", "https://example.com/a")
+
+    plays, lag = _measure(loop, work)
+
+    assert plays == 5
+    assert lag < MAX_LAG
+
+
+def test_concurrent_commands_share_a_pipeline(loop, storage):
+    async def work():
+        return await asyncio.gather(
+            *[storage.hincrby("musicbot:played", "https://example.com/%s" % i, 1) for i in range(50)])
+
+    results, lag = _measure(loop, work)
+
+    assert results == [1] * 50
+    assert storage.redis.round_trips <= 2
+    assert lag < MAX_LAG
+
+
+def test_write_behind_keeps_the_loop_responsive(loop, storage):
+    write_behind = WriteBehind(storage, interval=0.01)
+
+    async def work():
+        for i in range(20):
+            write_behind.write('rpush', "musicbot:queue:1", str(i))
+            await asyncio.sleep(0.005)
+
+        await write_behind.flush()
+        return await storage.lrange("musicbot:queue:1", 0, -1)
+
+    queue, lag = _measure(loop, work)
+
+    assert queue == [str(i) for i in range(20)]
+    assert lag < MAX_LAG
+
+
+def test_write_behind_rewrites_mirrored_lists_after_a_failed_batch(loop, storage):
+    write_behind = WriteBehind(storage, interval=0.01)
+    queue = []
+    write_behind.mirror("musicbot:queue:1", lambda: list(queue))
+
+    def push(value):
+        queue.append(value)
+        write_behind.write('rpush', "musicbot:queue:1", value)
+
+    async def work():
+        push('a')
+        await write_behind.flush()
+
+        storage.redis.fail_next = True
+        push('b')
+        with pytest.raises(ConnectionError):
+            await write_behind.flush()
+
+        push('c')
+        await write_behind.flush()
+        return await storage.lrange("musicbot:queue:1", 0, -1)
+
+    saved, _ = _measure(loop, work)
+
+    assert saved == ['a', 'b', 'c']